@@ -0,0 +1,235 @@
+# Benchmark suite for the data pipeline and the models, over a synthetic dataset.
+#
+#   python benchmark.py --players 200 --rows 200 --out bench.json
+#
+# Results are written as json, so different runs can be compared.
+import argparse
+import contextlib
+import io
+import json
+import os
+import pickle
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from enum import Enum
+from typing import Callable, Dict
+
+import numpy as np
+
+from items import Inventory
+from models import NoOpPredictor, NaiveBayesPredictor1, NaiveBayesPredictor2, NaiveBayesPredictor3
+from utils import read_file, read_codes, read_item_table, split_datasets, count_kits, compute_kit_modifications, \
+    generate_dataset, model_errors
+from utils.manifest import manifest_path
+
+MODELS = [NoOpPredictor, NaiveBayesPredictor1, NaiveBayesPredictor2, NaiveBayesPredictor3]
+
+# Import time budgets (seconds, fresh interpreter). Prediction workers & short cli jobs only need items + models,
+# which shouldn't pull in pandas, pyarrow or matplotlib
+IMPORT_BUDGETS = {"items": 0.25, "items, models": 0.3, "utils": 1.5}
+
+
+def measure(fn: Callable[[], object], repeat: int = 3, items: int = None) -> Dict[str, float]:
+    """
+    Time a function, keeping the best of a few runs
+    :param items: amount of items processed per run, to also report the time per item
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+    result = {"seconds": min(times), "mean_seconds": float(np.mean(times))}
+    if items:
+        result["items"] = items
+        result["us_per_item"] = min(times) / items * 1e6
+    return result
+
+
+def import_time(modules: str, repeat: int = 3) -> float:
+    """
+    Best time to import some modules in a fresh interpreter
+    """
+    code = "import time; start = time.perf_counter(); import %s; print(time.perf_counter() - start)" % modules
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    return min(float(subprocess.run([sys.executable, "-c", code], cwd=cwd, capture_output=True, check=True,
+                                    text=True).stdout) for _ in range(repeat))
+
+
+def run_imports(repeat: int = 3) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for modules, budget in IMPORT_BUDGETS.items():
+        seconds = import_time(modules, repeat)
+        name = "import[%s]" % modules
+        results[name] = {"seconds": seconds, "budget_seconds": budget, "within_budget": seconds <= budget}
+        print("%-40s %10.4fs%s" % (name, seconds, "" if seconds <= budget else " OVER BUDGET"))
+    return results
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def resident_bytes(obj: object) -> int:
+    """
+    Approximate memory held by an object: its own size plus everything reachable through its attributes, containers
+    and array buffers. Shared objects like categories (enum members) and classes aren't counted.
+    """
+    seen = set()
+
+    def size(o: object) -> int:
+        if id(o) in seen or isinstance(o, (Enum, type)):
+            return 0
+        seen.add(id(o))
+        total = sys.getsizeof(o)  # Includes the data of arrays that own it
+        if isinstance(o, np.ndarray) and o.base is not None:
+            total += size(o.base)
+        if isinstance(o, dict):
+            total += sum(size(k) + size(v) for k, v in o.items())
+        elif isinstance(o, (list, tuple, set)):
+            total += sum(size(v) for v in o)
+        if hasattr(o, "__dict__"):
+            total += size(vars(o))
+        for cls in type(o).__mro__:
+            total += sum(size(getattr(o, name)) for name in getattr(cls, "__slots__", ()) if hasattr(o, name))
+        return total
+
+    return size(obj)
+
+
+def run(ds: str, repeat: int = 3) -> Dict[str, Dict[str, float]]:
+    files = [ds + "/" + f for f in os.listdir(ds)]
+    rows = sum(len(read_codes(f)[0]) for f in files)
+    results: Dict[str, Dict[str, float]] = {}
+
+    def bench(name: str, fn: Callable[[], object], items: int = None, times: int = repeat):
+        results[name] = measure(fn, times, items)
+        print("%-40s %10.4fs" % (name, results[name]["seconds"]))
+
+    bench("read_file[categories]", lambda: [read_file(f, only_category=True) for f in files], rows)
+    bench("read_file[item_stacks]", lambda: [read_file(f) for f in files], rows, 1)
+    bench("read_codes", lambda: [read_codes(f) for f in files], rows)
+    bench("read_item_table", lambda: [read_item_table(f) for f in files], rows)
+
+    splits = tempfile.mkdtemp()
+    try:
+        # Split a linked copy of the dataset, so its manifest is written in the temp directory instead of next to ds
+        source = splits + "/source"
+        shutil.copytree(ds, source, copy_function=link_or_copy)
+
+        def split_cold():
+            if os.path.exists(manifest_path(source)):
+                os.remove(manifest_path(source))
+            split_datasets([10, 50, 100], source, splits + "/min_", dry_run=False)
+
+        bench("split_datasets[cold]", split_cold, len(files), 1)
+        bench("split_datasets[warm]", lambda: split_datasets([10, 50, 100], source, splits + "/min_", dry_run=False),
+              len(files))
+        bench("split_datasets[dry_run]", lambda: split_datasets([10, 50, 100], source, splits + "/min_", dry_run=True),
+              len(files))
+    finally:
+        shutil.rmtree(splits)
+
+    bench("count_kits", lambda: count_kits(ds), rows)
+    bench("compute_kit_modifications", lambda: compute_kit_modifications(ds), rows, 1)
+
+    player = max(files, key=lambda f: len(read_codes(f)[0]))
+    kits, prefs = read_codes(player)
+    inventories = [(Inventory.of_codes(k), Inventory.of_codes(p)) for k, p in zip(kits, prefs)]
+    for model_cls in MODELS:
+        name = model_cls.__name__
+        bench("try_model[%s]" % name, lambda: model_errors(kits, prefs, model_cls), len(kits))
+
+        def learn():
+            model = model_cls()
+            for kit, pref in inventories:
+                model.learn(kit, pref)
+
+        trained = model_cls()
+        for kit, pref in inventories:
+            trained.learn(kit, pref)
+
+        bench("learn[%s]" % name, learn, len(kits))
+        bench("learn_batch[%s]" % name, lambda: model_cls().learn_batch(kits, prefs), len(kits))
+        bench("predict_kit[%s]" % name, lambda: [trained.predict_kit(kit) for kit, _ in inventories], len(kits))
+        bench("predict_kits[%s]" % name, lambda: trained.predict_kits(kits), len(kits))
+
+    # Memory & serialization cost of holding a trained model for every player
+    codes = [read_codes(f) for f in files]
+    for model_cls in MODELS[1:]:
+        name = model_cls.__name__
+        models = []
+        for kits, prefs in codes:
+            model = model_cls()
+            model.learn_batch(kits, prefs)
+            models.append(model)
+
+        def serialize():
+            return [pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL) for model in models]
+
+        serialized = serialize()
+        size = results["model_bytes[%s]" % name] = {
+            "players": len(models),
+            "bytes_per_player": float(np.mean([resident_bytes(model) for model in models])),
+            "serialized_bytes_per_player": float(np.mean([len(data) for data in serialized])),
+        }
+        print("%-40s %10d bytes/player" % ("model_bytes[%s]" % name, size["bytes_per_player"]))
+        bench("serialize[%s]" % name, serialize, len(models))
+        bench("deserialize[%s]" % name, lambda: [pickle.loads(data) for data in serialized], len(models))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data pipeline and models on a synthetic dataset")
+    parser.add_argument("--players", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=200, help="average rows per player")
+    parser.add_argument("--kit-types", type=int, default=50)
+    parser.add_argument("--skew", type=float, default=1.2)
+    parser.add_argument("--edit-rate", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--data", default=None, help="existing dataset directory, instead of a generated one")
+    parser.add_argument("--out", default="bench.json")
+    args = parser.parse_args()
+
+    tmp = None
+    ds = args.data
+    if ds is None:
+        tmp = tempfile.mkdtemp()
+        ds = tmp + "/all"
+        generate_dataset(ds, args.players, args.rows, args.kit_types, args.skew, args.edit_rate, args.seed)
+
+    try:
+        results = run_imports(args.repeat)
+        results.update(run(ds, args.repeat))
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results written to " + args.out)
+
+
+if __name__ == "__main__":
+    main()
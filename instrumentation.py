@@ -0,0 +1,293 @@
+# Lightweight timers, counters & profiles for the hot paths in utils and models.
+#
+#   import instrumentation
+#   instrumentation.enable()                 # or set KIT_INSTRUMENT=1 (KIT_INSTRUMENT=profile to also run cProfile)
+#   ... run notebook cells ...
+#   print(instrumentation.format_report())   # or instrumentation.save_report("report.json")
+#
+# Everything is disabled by default, then instrumented functions only pay for a flag check. Functions run by pool
+# worker processes are wrapped with task(), and their results unwrapped with task_result(), so the stats recorded in the
+# workers are merged into the parent's.
+import cProfile
+import functools
+import io
+import json
+import marshal
+import os
+import pstats
+import time
+from contextlib import contextmanager
+from typing import Dict, Callable, TypeVar, Optional, Any, List
+
+F = TypeVar("F", bound=Callable)
+
+_enabled = os.environ.get("KIT_INSTRUMENT", "") not in ("", "0")
+_profiling = os.environ.get("KIT_INSTRUMENT", "") == "profile"
+
+
+class TimerStats:
+    __slots__ = ("calls", "total", "min", "max")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, elapsed: float) -> None:
+        self.calls += 1
+        self.total += elapsed
+        if elapsed < self.min:
+            self.min = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def merge(self, calls: int, total: float, min_: float, max_: float) -> None:
+        self.calls += calls
+        self.total += total
+        self.min = min(self.min, min_)
+        self.max = max(self.max, max_)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"calls": self.calls, "total_s": self.total, "mean_us": self.total / self.calls * 1e6,
+                "min_us": self.min * 1e6, "max_us": self.max * 1e6}
+
+
+timers: Dict[str, TimerStats] = {}
+counters: Dict[str, int] = {}
+profiles: Dict[str, pstats.Stats] = {}
+
+
+def enable(profiling: bool = False) -> None:
+    """
+    Start collecting timers and counters
+    :param profiling: also capture a cProfile for every profile() block, like each player in evaluate_player
+    """
+    global _enabled, _profiling
+    _enabled = True
+    _profiling = profiling
+
+
+def disable() -> None:
+    global _enabled, _profiling
+    _enabled = False
+    _profiling = False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    timers.clear()
+    counters.clear()
+    profiles.clear()
+
+
+def _record(name: str, elapsed: float) -> None:
+    stats = timers.get(name)
+    if stats is None:
+        stats = timers[name] = TimerStats()
+    stats.add(elapsed)
+
+
+@contextmanager
+def timer(name: str):
+    """
+    Time a block of code under a name, calls with the same name are aggregated
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def timed(name: str = None) -> Callable[[F], F]:
+    """
+    Decorator version of timer, the name defaults to the function's qualified name
+    """
+
+    def decorator(fn: F) -> F:
+        key = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(key, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, amount: int = 1) -> None:
+    """
+    Increase a named counter, like the amount of rows or files processed
+    """
+    if _enabled:
+        counters[name] = counters.get(name, 0) + amount
+
+
+@contextmanager
+def profile(key: str):
+    """
+    Capture a cProfile of a block (a player, a file...) when profiling is enabled. Profiles with the same key are merged
+    """
+    if not _profiling:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        if key in profiles:
+            profiles[key].add(stats)
+        else:
+            profiles[key] = stats
+
+
+class _MarshalledProfile:
+    # What pstats.Stats needs to load profile data that isn't in a file (same interface as cProfile.Profile)
+    def __init__(self, data: bytes):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self) -> None:
+        pass
+
+
+def collect() -> Dict[str, Any]:
+    """
+    Stats collected in this process, in a picklable form for merge
+    """
+    return {
+        "timers": {name: (stats.calls, stats.total, stats.min, stats.max) for name, stats in timers.items()},
+        "counters": dict(counters),
+        "profiles": {key: marshal.dumps(stats.stats) for key, stats in profiles.items()},
+    }
+
+
+def merge(collected: Dict[str, Any]) -> None:
+    """
+    Add stats collected in another process (see collect) to this one's
+    """
+    for name, values in collected["timers"].items():
+        stats = timers.get(name)
+        if stats is None:
+            stats = timers[name] = TimerStats()
+        stats.merge(*values)
+    for name, amount in collected["counters"].items():
+        counters[name] = counters.get(name, 0) + amount
+    for key, data in collected["profiles"].items():
+        stats = pstats.Stats(_MarshalledProfile(data))
+        if key in profiles:
+            profiles[key].add(stats)
+        else:
+            profiles[key] = stats
+
+
+class _TaskResult:
+    __slots__ = ("value", "stats")
+
+    def __init__(self, value: Any, stats: Dict[str, Any]):
+        self.value = value
+        self.stats = stats
+
+
+class _Task:
+    """
+    Picklable wrapper running a function in a worker process with the parent's settings, returning the function's
+    result together with the stats it recorded
+    """
+
+    def __init__(self, fn: Callable, profiling: bool):
+        self.fn = fn
+        self.profiling = profiling
+
+    def __call__(self, *args, **kwargs) -> _TaskResult:
+        global _enabled, _profiling
+        _enabled, _profiling = True, self.profiling
+        # Forked workers start with a copy of the parent's stats, only send back what this call recorded
+        reset()
+        try:
+            value = self.fn(*args, **kwargs)
+            return _TaskResult(value, collect())
+        finally:
+            reset()
+
+
+def task(fn: F) -> F:
+    """
+    Wrap a function to be run by a process pool, so the stats recorded in the workers can reach this process. Results
+    must then go through task_result. Functions run by thread pools share this process' stats and need no wrapping.
+    When instrumentation is disabled the function is returned as-is.
+    """
+    return _Task(fn, _profiling) if _enabled else fn
+
+
+def task_result(result: Any) -> Any:
+    """
+    Unwrap the result of a function wrapped with task, merging the stats recorded by the worker
+    """
+    if isinstance(result, _TaskResult):
+        merge(result.stats)
+        return result.value
+    return result
+
+
+def _top_functions(stats: pstats.Stats, limit: int) -> List[Dict[str, Any]]:
+    entries = sorted(stats.stats.items(), key=lambda e: e[1][3], reverse=True)[0:limit]
+    return [{"function": "%s:%d(%s)" % func, "calls": calls, "total_s": total, "cumulative_s": cumulative}
+            for func, (_, calls, total, cumulative, _) in entries]
+
+
+def report(profile_limit: int = 20) -> Dict[str, Any]:
+    """
+    Collected stats as a json serializable dict
+    :param profile_limit: amount of functions (by cumulative time) to include for each profile
+    """
+    return {
+        "timers": {name: stats.to_dict() for name, stats in sorted(timers.items(), key=lambda e: -e[1].total)},
+        "counters": dict(counters),
+        "profiles": {key: _top_functions(stats, profile_limit) for key, stats in profiles.items()},
+    }
+
+
+def format_report(profile_key: Optional[str] = None, profile_limit: int = 20) -> str:
+    """
+    Collected stats as a text table, timers sorted by total time
+    :param profile_key: also include the cProfile output of this profile
+    """
+    lines = ["%-50s %10s %12s %12s %12s" % ("timer", "calls", "total (s)", "mean (us)", "max (us)")]
+    for name, stats in sorted(timers.items(), key=lambda e: -e[1].total):
+        lines.append("%-50s %10d %12.4f %12.1f %12.1f" % (name, stats.calls, stats.total,
+                                                         stats.total / stats.calls * 1e6, stats.max * 1e6))
+    if counters:
+        lines.append("")
+        lines.append("%-50s %10s" % ("counter", "value"))
+        for name, value in counters.items():
+            lines.append("%-50s %10d" % (name, value))
+    if profile_key is not None and profile_key in profiles:
+        out = io.StringIO()
+        stats = pstats.Stats(stream=out)
+        stats.add(profiles[profile_key])
+        stats.sort_stats("cumulative").print_stats(profile_limit)
+        lines.append("")
+        lines.append(out.getvalue())
+    return "\n".join(lines)
+
+
+def save_report(path: str, profile_limit: int = 20) -> None:
+    with open(path, "w") as f:
+        json.dump(report(profile_limit), f, indent=2)
@@ -1,8 +1,11 @@
+import hashlib
 from enum import Enum
 from typing import List, Dict, Iterable, Optional
 
+import numpy as np
+
 from .enchantment import Enchantment
-from .materials import Material, find_material
+from .materials import Material, find_material, materials_between
 
 
 def find_materials(query):
@@ -36,11 +39,14 @@ class EnchantmentCategory(Category):
         return 0, result
 
 
+# Material lists are spelled out (in Material order, see find_materials) instead of searched for, to keep imports fast
 class Tool(EnchantmentCategory, Enum):
-    PICKAXE = find_materials("_PICKAXE")
-    AXE = find_materials("_AXE")
-    SPADE = find_materials("_SPADE")
-    HOE = find_materials("_HOE")
+    PICKAXE = [Material.IRON_PICKAXE, Material.WOOD_PICKAXE, Material.STONE_PICKAXE, Material.DIAMOND_PICKAXE,
+               Material.GOLD_PICKAXE]
+    AXE = [Material.IRON_AXE, Material.WOOD_AXE, Material.STONE_AXE, Material.DIAMOND_AXE, Material.GOLD_AXE]
+    SPADE = [Material.IRON_SPADE, Material.WOOD_SPADE, Material.STONE_SPADE, Material.DIAMOND_SPADE,
+             Material.GOLD_SPADE]
+    HOE = [Material.WOOD_HOE, Material.STONE_HOE, Material.IRON_HOE, Material.DIAMOND_HOE, Material.GOLD_HOE]
     SHEARS = [Material.SHEARS]
 
     def __init__(self, materials):
@@ -50,7 +56,8 @@ class Tool(EnchantmentCategory, Enum):
 
 
 class Weapon(EnchantmentCategory, Enum):
-    SWORD = find_materials("_SWORD"), [Enchantment.DAMAGE_ALL, Enchantment.KNOCKBACK, Enchantment.FIRE_ASPECT]
+    SWORD = [Material.IRON_SWORD, Material.WOOD_SWORD, Material.STONE_SWORD, Material.DIAMOND_SWORD,
+             Material.GOLD_SWORD], [Enchantment.DAMAGE_ALL, Enchantment.KNOCKBACK, Enchantment.FIRE_ASPECT]
     BOW = [Material.BOW], [Enchantment.ARROW_DAMAGE, Enchantment.ARROW_KNOCKBACK, Enchantment.ARROW_FIRE,
                            Enchantment.ARROW_INFINITE]
 
@@ -84,7 +91,7 @@ class Consumable(Category, Enum):
 
 
 class Block(Category, Enum):
-    BLOCK = [m for m in list(Material) if 0 < m.value < 256]
+    BLOCK = materials_between(1, 256)
 
     def __init__(self, materials):
         super().__init__()
@@ -111,6 +118,19 @@ class Item(Category):
 class Categories:
     CATEGORY_MAP: Dict[Material, Category] = {}
     CATEGORY_LIST: List[Category] = []
+    # Dense integer code for each category, 0 is reserved for empty slots. Code i is CATEGORY_LIST[i - 1]
+    CATEGORY_CODES: Dict[Category, int] = {}
+    CODE_DTYPE = np.int16
+    # Category families, each gets a bit in the family masks
+    FAMILIES: List[type] = [Weapon, Tool, Consumable, Block, Bucket, Item]
+
+    __material_codes: Optional[np.ndarray] = None
+    __code_objects: Optional[np.ndarray] = None
+    __family_bits: Optional[np.ndarray] = None
+    __enchant_masks: Optional[np.ndarray] = None
+    __family_masks: Dict[type, int] = {}
+    __sort_ranks: Optional[np.ndarray] = None
+    __fingerprint: Optional[str] = None
 
     @classmethod
     def setup(cls):
@@ -119,12 +139,19 @@ class Categories:
         cls.__add_categories(Consumable)
         cls.__add_categories(Block)
         cls.__add_categories(Bucket)
+        # Register generic items upfront, so that codes are stable no matter the order items are read in
+        for mat in list(Material):
+            if mat not in cls.CATEGORY_MAP:
+                cls.__add_category(Item(mat))
 
     @classmethod
     def __add_category(cls, category: Category):
         cls.CATEGORY_LIST.append(category)
+        cls.CATEGORY_CODES[category] = len(cls.CATEGORY_LIST)
         for mat in category.get_all():
             cls.CATEGORY_MAP[mat] = category
+        cls.__material_codes = cls.__code_objects = cls.__family_bits = cls.__enchant_masks = None
+        cls.__sort_ranks = cls.__fingerprint = None
 
     @classmethod
     def __add_categories(cls, categories: Iterable[Category]):
@@ -137,7 +164,8 @@ class Categories:
             return None
         cat: Optional[Category] = cls.CATEGORY_MAP.get(mat)
         if cat is None:
-            cls.CATEGORY_MAP[mat] = cat = Item(mat)
+            cat = Item(mat)
+            cls.__add_category(cat)
         return cat
 
     @classmethod
@@ -146,5 +174,116 @@ class Categories:
             return None
         return Categories.of(find_material((serialized >> 16) & 0xffff))
 
+    @classmethod
+    def code_of(cls, cat: Optional[Category]) -> int:
+        return 0 if cat is None else cls.CATEGORY_CODES[cat]
+
+    @classmethod
+    def from_code(cls, code: int) -> Optional[Category]:
+        return None if code == 0 else cls.CATEGORY_LIST[code - 1]
+
+    @classmethod
+    def fingerprint(cls) -> str:
+        """
+        Hash of the code to category mapping, anything persisted using category codes is only valid for the same one
+        """
+        if cls.__fingerprint is None:
+            mapping = ";".join(str(cat) + "=" + ",".join(str(mat.value) for mat in cat.get_all())
+                               for cat in cls.CATEGORY_LIST)
+            cls.__fingerprint = hashlib.sha1(mapping.encode()).hexdigest()
+        return cls.__fingerprint
+
+    @classmethod
+    def material_codes(cls) -> np.ndarray:
+        """
+        Lookup table from material id (0 to 65535) to category code. Unknown material ids map to 0
+        """
+        if cls.__material_codes is None:
+            table = np.zeros(shape=1 << 16, dtype=cls.CODE_DTYPE)
+            for mat, cat in cls.CATEGORY_MAP.items():
+                table[mat.value] = cls.CATEGORY_CODES[cat]
+            table.flags.writeable = False
+            cls.__material_codes = table
+        return cls.__material_codes
+
+    @classmethod
+    def codesOfSerialized(cls, serialized: np.ndarray) -> np.ndarray:
+        """
+        Vectorized version of ofSerialized, converts a whole block of serialized items to category codes
+        :param serialized: array (any shape) of serialized item stacks
+        :return: array of the same shape with the category code for each item, 0 for empty slots
+        """
+        serialized = np.asarray(serialized, dtype=np.int64)
+        codes = cls.material_codes()[(serialized >> 16) & 0xffff]
+        codes[serialized == 0] = 0
+        return codes
+
+    @classmethod
+    def ofCodes(cls, codes: np.ndarray) -> np.ndarray:
+        """
+        Materialize category codes as an object array of categories (None for empty slots)
+        """
+        if cls.__code_objects is None:
+            objects = np.empty(shape=len(cls.CATEGORY_LIST) + 1, dtype=object)
+            for code, cat in enumerate(cls.CATEGORY_LIST, start=1):
+                objects[code] = cat
+            cls.__code_objects = objects
+        return cls.__code_objects[codes]
+
+    @classmethod
+    def sort_ranks(cls) -> np.ndarray:
+        """
+        Position of each category code when sorting categories (see Category.__lt__). Empty slots (code 0) sort last
+        """
+        if cls.__sort_ranks is None:
+            order = sorted(range(1, len(cls.CATEGORY_LIST) + 1), key=lambda code: cls.CATEGORY_LIST[code - 1])
+            ranks = np.zeros(shape=len(cls.CATEGORY_LIST) + 1, dtype=cls.CODE_DTYPE)
+            ranks[order] = np.arange(len(order))
+            ranks[0] = len(order)
+            ranks.flags.writeable = False
+            cls.__sort_ranks = ranks
+        return cls.__sort_ranks
+
+    @classmethod
+    def family_bits(cls) -> np.ndarray:
+        """
+        Family bit for each category code, 0 for empty slots
+        """
+        if cls.__family_bits is None:
+            bits = np.zeros(shape=len(cls.CATEGORY_LIST) + 1, dtype=np.int64)
+            for code, cat in enumerate(cls.CATEGORY_LIST, start=1):
+                bits[code] = cls.family_mask(type(cat))
+            bits.flags.writeable = False
+            cls.__family_bits = bits
+        return cls.__family_bits
+
+    @classmethod
+    def enchant_masks(cls) -> np.ndarray:
+        """
+        Mask of the data bits used for enchantments by each category code (see EnchantmentCategory), 0 for the rest
+        """
+        if cls.__enchant_masks is None:
+            masks = np.zeros(shape=len(cls.CATEGORY_LIST) + 1, dtype=np.uint8)
+            for code, cat in enumerate(cls.CATEGORY_LIST, start=1):
+                if isinstance(cat, EnchantmentCategory):
+                    masks[code] = (1 << len(cat.enchants)) - 1
+            masks.flags.writeable = False
+            cls.__enchant_masks = masks
+        return cls.__enchant_masks
+
+    @classmethod
+    def family_mask(cls, family: type) -> int:
+        """
+        Mask with the bits for every family that is (a subclass of) the given category type
+        """
+        mask = cls.__family_masks.get(family)
+        if mask is None:
+            mask = 0
+            for i, fam in enumerate(cls.FAMILIES):
+                if issubclass(fam, family):
+                    mask |= 1 << i
+            cls.__family_masks[family] = mask
+        return mask
+
 
 Categories.setup()
@@ -1,49 +1,75 @@
 import enum
-from typing import List
+from typing import Iterable, Tuple, Optional, TYPE_CHECKING
 from collections import Counter
 
-from pandas import Series
+import numpy as np
+
+from .categories import Categories, Category
+from .item_stack import ItemStack
+
+if TYPE_CHECKING:  # pandas is slow to import, and only needed for reading datasets
+    from pandas import Series
 
 
 class Inventory:
+    """
+    Immutable list of categories (or None for empty slots), backed by an array of category codes.
+    """
+    __slots__ = ("codes", "mask", "_hash", "_items")
+
+    def __init__(self, items: Iterable):
+        """
+        :param items: categories, or item stacks (only their category is kept), None for empty slots
+        """
+        self._set_codes(np.fromiter((Inventory._code_of(item) for item in items), dtype=Categories.CODE_DTYPE))
+
+    @staticmethod
+    def _code_of(item: object) -> int:
+        if isinstance(item, ItemStack):
+            item = item.category
+        code = Categories.CATEGORY_CODES.get(item) if item is not None else 0
+        if code is None:
+            raise TypeError("Inventory can only hold categories or item stacks, got " + repr(item))
+        return code
 
-    def __init__(self, items: List):
-        self.items = items
+    def _set_codes(self, codes: np.ndarray):
+        codes.flags.writeable = False
+        self.codes: np.ndarray = codes
+        # Bitmask of category families present in the inventory
+        self.mask: int = int(np.bitwise_or.reduce(Categories.family_bits()[codes])) if len(codes) > 0 else 0
+        self._hash: Optional[int] = None
+        self._items: Optional[Tuple[Category, ...]] = None
+
+    @property
+    def items(self) -> Tuple[Optional[Category], ...]:
+        if self._items is None:
+            self._items = tuple(Categories.ofCodes(self.codes).tolist())
+        return self._items
 
     def __str__(self):
         return "[" + ",".join([str(e) for e in self.items]) + "]"
 
     def __eq__(self, other) -> bool:
-        # Pandas series has an equals method
-        if hasattr(self.items, "equals") and callable(self.items.equals):
-            return self.items.equals(other.items)
-
-        res = self.items == other.items
-        # Numpy requires .all call, otherwise self.items == other.items actually returns a collection.
-        if hasattr(res, "all") and callable(res.all):
-            res = res.all()
-        return res
+        return isinstance(other, Inventory) and np.array_equal(self.codes, other.codes)
 
     def __hash__(self) -> int:
-        result: int = 1
-        for item in self.items:
-            result = 31 * result + hash(item)
+        if self._hash is None:
+            self._hash = hash(self.codes.tobytes())
+        return self._hash
 
-        return result
+    def __len__(self):
+        return len(self.codes)
 
     def __iter__(self):
         return iter(self.items)
 
     def __contains__(self, item):
-        if issubclass(item, enum.Enum):
-            for it in self.items:
-                if isinstance(it, item):
-                    return True
-        else:
-            for it in self.items:
-                if it == item:
-                    return True
-        return False
+        if isinstance(item, type):
+            if issubclass(item, enum.Enum):
+                return (self.mask & Categories.family_mask(item)) != 0
+            return False
+        code = Categories.CATEGORY_CODES.get(item) if item is not None else 0
+        return code is not None and bool(np.any(self.codes == code))
 
     def apply(self, fn):
         return Inventory([fn(item) for item in self.items])
@@ -51,13 +77,33 @@ class Inventory:
     def short_str(self):
         return "[" + ",".join([str(e) for e in self.items if e is not None]) + "]"
 
+    def bag_codes(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Codes and amounts of each category in the inventory, in order of first appearance
+        """
+        codes, first, counts = np.unique(self.codes, return_index=True, return_counts=True)
+        order = np.argsort(first, kind="stable")
+        codes, counts = codes[order], counts[order]
+        present = codes != 0
+        return codes[present], counts[present]
+
     def to_bag(self) -> Counter:
-        result = Counter()
-        for item in self.items:
-            if item is not None:
-                result[item] += 1
-        return result
+        codes, counts = self.bag_codes()
+        return Counter(dict(zip(Categories.ofCodes(codes).tolist(), counts.tolist())))
+
+    @staticmethod
+    def of_codes(codes: np.ndarray) -> "Inventory":
+        """
+        Create an inventory from an array of category codes. The array is not copied, and must not be modified after.
+        """
+        inv = Inventory.__new__(Inventory)
+        inv._set_codes(np.asarray(codes, dtype=Categories.CODE_DTYPE).view())
+        return inv
 
     @staticmethod
-    def of(row: Series, prefix: str) -> "Inventory":
+    def of(row: "Series", prefix: str) -> "Inventory":
+        """
+        Create an inventory from the <prefix>_0 to <prefix>_35 columns of a dataset row, as read by read_file. The
+        columns may hold categories or item stacks, item stacks are reduced to their category.
+        """
         return Inventory(row[(prefix + "_0"):(prefix + "_35")])
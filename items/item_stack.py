@@ -1,11 +1,17 @@
 from typing import List
 
+import numpy as np
+
 from .categories import Categories, Category
 from .materials import Material, find_material
 from .enchantment import Enchantment
 
 
 class ItemStack:
+    # Columns of an item table, the decoded form of serialized item stacks (see tableOfSerialized)
+    TABLE_DTYPE = np.dtype([("serialized", np.int64), ("material", np.uint16), ("amount", np.uint8),
+                            ("data", np.uint8), ("category", Categories.CODE_DTYPE), ("enchants", np.uint8),
+                            ("valid", bool)])
 
     def __init__(self, serialized: int):
         self.serialized: int = serialized
@@ -47,3 +53,63 @@ class ItemStack:
     @staticmethod
     def of(serialized: int):
         return None if serialized == 0 else ItemStack(serialized)
+
+    @staticmethod
+    def tableOfSerialized(serialized: np.ndarray, report: bool = True) -> np.ndarray:
+        """
+        Vectorized version of of, decodes a whole block of serialized items into an item table without creating objects
+        :param serialized: array (any shape) of serialized item stacks
+        :param report: print a single summary of the invalid item stacks found, instead of a line for each of them
+        :return: structured array (TABLE_DTYPE) of the same shape. Invalid item stacks are decoded the same way as
+        ItemStack does: no material, amount or data, and valid set to False
+        """
+        serialized = np.asarray(serialized, dtype=np.int64)
+        material = (serialized >> 16) & 0xffff
+        codes = Categories.material_codes()[material]
+        invalid = (serialized != 0) & (codes == 0)
+        kept = np.where(invalid, 0, serialized)
+
+        table = np.zeros(shape=serialized.shape, dtype=ItemStack.TABLE_DTYPE)
+        table["serialized"] = kept
+        table["material"] = np.where(invalid, 0, material)
+        table["amount"] = (kept >> 8) & 0xff
+        table["category"] = np.where(serialized == 0, 0, codes)
+        table["valid"] = ~invalid
+
+        # Enchantable categories store their enchantments in the data bits
+        data = (kept & 0xff).astype(np.uint8)
+        enchant_mask = Categories.enchant_masks()[table["category"]]
+        table["enchants"] = data & enchant_mask
+        table["data"] = np.where(enchant_mask > 0, 0, data)
+
+        if report and np.any(invalid):
+            ids = np.unique(material[invalid])
+            print("Invalid item stacks loaded: %d, mat ids: %s" % (np.count_nonzero(invalid), ", ".join(map(str, ids))))
+        return table
+
+    @staticmethod
+    def fromTable(entry: np.void):
+        """
+        Create the item stack for a single item table entry, None for empty slots
+        """
+        if entry["category"] == 0 and entry["valid"]:
+            return None
+        stack = ItemStack.__new__(ItemStack)
+        stack.serialized = int(entry["serialized"])
+        stack.material = find_material(int(entry["material"])) if entry["valid"] else None
+        stack.amount = int(entry["amount"])
+        stack.data = int(entry["data"])
+        stack.category = Categories.from_code(int(entry["category"]))
+        enchants = stack.category.enchants if entry["enchants"] else []
+        stack.enchants = [enchant for i, enchant in enumerate(enchants) if entry["enchants"] & (1 << i)]
+        return stack
+
+    @staticmethod
+    def ofTable(table: np.ndarray) -> np.ndarray:
+        """
+        Materialize an item table (or a slice of one) as an object array of item stacks (None for empty slots)
+        """
+        result = np.empty(shape=table.shape, dtype=object)
+        for idx in zip(*np.nonzero((table["category"] != 0) | ~table["valid"])):
+            result[idx] = ItemStack.fromTable(table[idx])
+        return result
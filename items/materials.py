@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Dict
+from typing import Dict, List
 
 
 class Material(Enum):
@@ -401,3 +401,10 @@ for mat in list(Material):
 
 def find_material(material_id: int):
     return MATERIAL_CACHE.get(material_id)
+
+
+def materials_between(start: int, end: int) -> List[Material]:
+    """
+    Materials with start <= id < end, in id order
+    """
+    return [MATERIAL_CACHE[i] for i in range(start, end) if i in MATERIAL_CACHE]
@@ -1,63 +1,245 @@
-from collections import defaultdict
-from typing import Dict
+from __future__ import annotations
 
-from nptyping import *
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple, TYPE_CHECKING
 
 from items import *
 import numpy as np
 
+from instrumentation import timed
+
+if TYPE_CHECKING:  # nptyping imports pandas, which is slow and not needed for predicting
+    from nptyping import *
+
+
+# Assignment engines: given a (items x 9) score matrix, the amount of each item and the item codes & hotbar of the
+# original kit, return for each of the 9 hotbar slots the index of the item assigned to it (or -1 for empty slots).
+def greedy_assignment(scores: NDArray[Shape["*,9"], Float], counts: NDArray[Shape["*"], Int],
+                      codes: NDArray[Shape["*"], Int], bar: NDArray[Shape["9"], Int]) -> NDArray[Shape["9"], Int]:
+    """
+    Repeatedly place the item with the highest score in its best slot.
+    Ties go to the first item in the bag and the first slot, items without any preference keep their original slot.
+    """
+    scores = np.array(scores, dtype=float)
+    counts = np.array(counts)
+    slots = np.full(shape=9, fill_value=-1, dtype=int)
+
+    while np.any(counts > 0):
+        item, slot = divmod(int(np.argmax(scores)), 9)
+        value = scores[item, slot]
+        if value == -1:  # We ran out of preferences (even 0%'s). Means we filled all slots
+            break
+
+        # Default pick (no preferences), try to search for original position in kit.
+        if value == 0:
+            original = np.flatnonzero((bar == codes[item]) & (scores[item] != -1))
+            if len(original) > 0:
+                slot = original[0]
+
+        if slots[slot] != -1:
+            raise Exception("Attempted to put 2 items in same slot")
+        slots[slot] = item
+
+        counts[item] -= 1
+        if counts[item] <= 0:
+            scores[item, :] = -np.inf
+        scores[counts > 0, slot] = -1
+
+    return slots
+
+
+# All hotbar slot masks that are missing each slot
+_FREE_MASKS = [np.array([m for m in range(1 << 9) if not m & (1 << j)]) for j in range(9)]
+
+
+def optimal_assignment(scores: NDArray[Shape["*,9"], Float], counts: NDArray[Shape["*"], Int],
+                       codes: NDArray[Shape["*"], Int], bar: NDArray[Shape["9"], Int]) -> NDArray[Shape["9"], Int]:
+    """
+    Place items to maximize the total score over all slots.
+    Ties prefer items kept in their original slot, then more slots filled, then the first item and slot.
+    """
+    copies = np.repeat(np.arange(len(counts)), np.minimum(counts, 9))
+    # Best (score, tie-break) for each set of used slots, built with one item copy at a time
+    best = np.full(shape=1 << 9, fill_value=-np.inf)
+    best[0] = 0
+    tie = np.zeros(shape=1 << 9, dtype=int)
+    choice = np.full(shape=(len(copies), 1 << 9), fill_value=-1, dtype=int)
+
+    for k, item in enumerate(copies):
+        new_best, new_tie = best.copy(), tie.copy()
+        for slot in range(9):
+            src = _FREE_MASKS[slot]
+            dst = src | (1 << slot)
+            cand_best = best[src] + scores[item, slot]
+            cand_tie = tie[src] + (16 if bar[slot] == codes[item] else 0) + 1
+            better = np.isfinite(cand_best) & ((cand_best > new_best[dst]) |
+                                               ((cand_best == new_best[dst]) & (cand_tie > new_tie[dst])))
+            new_best[dst[better]] = cand_best[better]
+            new_tie[dst[better]] = cand_tie[better]
+            choice[k, dst[better]] = slot
+        best, tie = new_best, new_tie
+
+    mask = int(np.lexsort((-np.arange(1 << 9), tie, best))[-1])
+    slots = np.full(shape=9, fill_value=-1, dtype=int)
+    for k in reversed(range(len(copies))):
+        slot = choice[k, mask]
+        if slot >= 0:
+            slots[slot] = copies[k]
+            mask ^= 1 << slot
+    return slots
+
 
 class KitPredictor:
+    # Models are kept for every active player, slots avoid a per-instance __dict__
+    __slots__ = ("revision", "cache_size", "cache_hits", "cache_misses", "_cache", "_assignment")
+    # Bump when a change makes the model predict differently, stored results & snapshots are only reused for the same
+    # version
+    MODEL_VERSION = 1
+
+    def __init__(self, cache_size: int = 0, assignment: Callable = greedy_assignment) -> None:
+        """
+        :param cache_size: max amount of predictions to keep in an LRU cache, 0 to disable caching
+        :param assignment: slot assignment engine, see greedy_assignment and optimal_assignment
+        """
+        # Bumped every time the model learns, predictions are only cached for the same revision
+        self.revision: int = 0
+        self.cache_size: int = cache_size
+        self.cache_hits: int = 0
+        self.cache_misses: int = 0
+        self._cache: OrderedDict[Tuple[int, Inventory], Inventory] = OrderedDict()
+        self._assignment: Callable = assignment
+
+    @property
+    def assignment(self) -> Callable:
+        """
+        Pluggable slot assignment engine, see greedy_assignment and optimal_assignment
+        """
+        return self._assignment
+
+    @assignment.setter
+    def assignment(self, engine: Callable) -> None:
+        self._assignment = engine
+        # Cached predictions were made with the previous engine
+        self._cache.clear()
+
+    @timed()
     def predict_kit(self, kit: Inventory) -> Inventory:
-        if self.ignore_kit(kit):
-            return kit
-
-        vals: Dict[Category, NDArray[Shape["9"], Float]] = {}
-
-        bag = kit.to_bag()
-        for item, amt in bag.items():
-            vals[item] = self.predict(kit, item)
-
-        prediction: Inventory = Inventory([None] * 9)
-
-        while len(bag) >= 1:
-            k, v = max(vals.items(), key=lambda itm: np.max(itm[1]))
-            slot = np.argmax(v)
-            if v[slot] == -1:  # We ran out of preferences (even 0%'s). Means we filled all slots
-                break
-
-            # Default pick (no preferences), try to search for original position in kit.
-            if v[slot] == 0:
-                for idx, it in zip(range(0, 9), kit.items):
-                    if it == k and v[idx] != -1:
-                        slot = idx
-                        break
+        if self.cache_size <= 0:
+            return self._predict_kit(kit)
+
+        key = (self.revision, kit)
+        prediction = self._cache.get(key)
+        if prediction is not None:
+            self.cache_hits += 1
+            self._cache.move_to_end(key)
+            return prediction
+
+        self.cache_misses += 1
+        # Model changed since last prediction, older entries will never be hit again
+        if self._cache and next(reversed(self._cache))[0] != self.revision:
+            self._cache.clear()
+
+        prediction = self._cache[key] = self._predict_kit(kit)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return prediction
 
-            if prediction.items[slot] is not None:
-                raise Exception("Attempted to put 2 items in same slot")
+    def __getstate__(self) -> Dict[str, object]:
+        # Cached predictions aren't worth serializing, models are restored with an empty cache
+        return {name: getattr(self, name) for cls in type(self).__mro__ for name in getattr(cls, "__slots__", ())
+                if name != "_cache" and hasattr(self, name)}
 
-            prediction.items[slot] = k
+    def __setstate__(self, state: Dict[str, object]) -> None:
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._cache = OrderedDict()
 
-            bag[k] -= 1
-            if bag[k] <= 0:
-                del bag[k]
-                del vals[k]
+    def cache_stats(self) -> Dict[str, float]:
+        total = self.cache_hits + self.cache_misses
+        return {"hits": self.cache_hits, "misses": self.cache_misses, "size": len(self._cache),
+                "hit_rate": self.cache_hits / total if total > 0 else 0}
 
-            for v in vals.values():
-                v[slot] = -1
+    def _predict_kit(self, kit: Inventory) -> Inventory:
+        if self.ignore_kit(kit):
+            return kit
 
-        return prediction
+        codes, counts = kit.bag_codes()
+        # Same scoring as predict_kits, one row per bag item
+        scores = self.predict_batch(np.repeat(kit.codes[None, :], len(codes), axis=0), codes)
+
+        slots = self.assignment(scores, counts, codes, kit.codes[0:9])
+        return Inventory.of_codes(np.append(codes, 0)[slots])
+
+    @timed()
+    def predict_kits(self, kits: NDArray[Shape["*,36"], Int]) -> NDArray[Shape["*,9"], Int]:
+        """
+        Predict a whole batch of kits at once, same results as calling predict_kit for each of them.
+        Identical kits are only predicted once, and item scores for all kits are computed together.
+        :param kits: (rows x 36) matrix of category codes
+        :return: (rows x 9) matrix with the category codes of the predicted hotbar for each kit
+        """
+        kits = np.asarray(kits)
+        unique, inverse = np.unique(kits, axis=0, return_inverse=True)
+        result = unique[:, 0:9].copy()
+
+        masks = np.bitwise_or.reduce(Categories.family_bits()[unique], axis=1) if unique.size > 0 \
+            else np.zeros(shape=len(unique), dtype=np.int64)
+        predicted = np.flatnonzero(~self.ignore_kits(unique, masks))
+        if len(predicted) == 0:
+            return result[inverse.reshape(-1)]
+
+        bags = [Inventory.of_codes(unique[k]).bag_codes() for k in predicted]
+        sizes = np.array([len(codes) for codes, _ in bags])
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        scores = self.predict_batch(np.repeat(unique[predicted], sizes, axis=0),
+                                    np.concatenate([codes for codes, _ in bags]))
+
+        for idx, (k, (codes, counts)) in enumerate(zip(predicted, bags)):
+            slots = self.assignment(scores[offsets[idx]:offsets[idx + 1]], counts, codes, unique[k, 0:9])
+            result[k] = np.append(codes, 0)[slots]
+        return result[inverse.reshape(-1)]
 
     def ignore_kit(self, kit: Inventory):
         pass
 
+    def ignore_kits(self, kits: NDArray[Shape["*,36"], Int], masks: NDArray[Shape["*"], Int]) \
+            -> NDArray[Shape["*"], Bool]:
+        """
+        Batch version of ignore_kit
+        :param kits: (rows x 36) matrix of category codes
+        :param masks: category family mask for each kit, see Inventory.mask
+        """
+        return np.array([bool(self.ignore_kit(Inventory.of_codes(kit))) for kit in kits], dtype=bool)
+
     def predict(self, kit: Inventory, item: object) -> NDArray[Shape["9"], Float]:
         pass
 
+    def predict_batch(self, kits: NDArray[Shape["*,36"], Int], items: NDArray[Shape["*"], Int]) \
+            -> NDArray[Shape["*,9"], Float]:
+        """
+        Batch version of predict, the score of each item for each slot, given the kit it's in
+        :param kits: (rows x 36) matrix of category codes
+        :param items: category code of the item to predict for each row
+        """
+        scores = np.zeros(shape=(len(kits), 9), dtype=float)
+        for idx, (kit, item) in enumerate(zip(kits, items)):
+            scores[idx] = self.predict(Inventory.of_codes(kit), Categories.from_code(int(item)))
+        return scores
+
     def learn(self, kit: Inventory, pref: Inventory) -> None:
         pass
 
+    def learn_batch(self, kits: NDArray[Shape["*,36"], Int], prefs: NDArray[Shape["*,36"], Int]) -> None:
+        """
+        Learn from a whole history of kits at once, in order
+        :param kits: (rows x 36) matrix of category codes for the kits given
+        :param prefs: (rows x 36) matrix of category codes for the kits as sorted by the player
+        """
+        for kit, pref in zip(kits, prefs):
+            self.learn(Inventory.of_codes(kit), Inventory.of_codes(pref))
+
     @staticmethod
+    @timed()
     def calculate_diff(predicted: Inventory, actual: Inventory):
         item_count = 0
         diff_count = 0
@@ -71,24 +253,58 @@ class KitPredictor:
                 diff_count = diff_count + 1
         return diff_count / item_count if item_count > 0 else 0
 
+    @staticmethod
+    @timed()
+    def calculate_diffs(predicted: NDArray[Shape["*,*"], Int], actual: NDArray[Shape["*,*"], Int]) \
+            -> NDArray[Shape["*"], Float]:
+        """
+        Vectorized calculate_diff, over the hotbar of each row
+        :param predicted: (rows x 9+) matrix of category codes predicted
+        :param actual: (rows x 9+) matrix of category codes as sorted by the player
+        :return: for each row, the fraction of non-empty actual hotbar slots that weren't predicted, 0 if none
+        """
+        present = actual[:, 0:9] != 0
+        items = np.count_nonzero(present, axis=1)
+        diffs = np.count_nonzero(present & (predicted[:, 0:9] != actual[:, 0:9]), axis=1)
+        return np.divide(diffs, items, out=np.zeros(shape=len(items), dtype=float), where=items > 0)
+
 
 class NoOpPredictor(KitPredictor):
+    __slots__ = ()
+
     def ignore_kit(self, kit: Inventory):
         return True
 
+    def ignore_kits(self, kits: NDArray[Shape["*,36"], Int], masks: NDArray[Shape["*"], Int]) \
+            -> NDArray[Shape["*"], Bool]:
+        return np.ones(shape=len(kits), dtype=bool)
+
+
+# Kits without weapons or tools are left as-is by the naive bayes predictors
+_WEAPON_OR_TOOL = Categories.family_mask(Weapon) | Categories.family_mask(Tool)
+
+
+def _default_positions(kits: NDArray[Shape["*,36"], Int], items: NDArray[Shape["*"], Int]) \
+        -> NDArray[Shape["*,9"], Float]:
+    return (kits[:, 0:9] == items[:, None]).astype(float)
+
 
 class NaiveBayesPredictor1(KitPredictor):
+    __slots__ = ("chances",)
 
-    def __init__(self) -> None:
-        super().__init__()
-        self.chances: Dict[Category, NDArray[Shape["9"], Float]] = \
-            defaultdict(lambda: np.zeros(shape=9, dtype=float))
+    def __init__(self, cache_size: int = 0, assignment: Callable = greedy_assignment) -> None:
+        super().__init__(cache_size, assignment)
+        self.chances: Dict[Category, NDArray[Shape["9"], Float]] = {}
 
     def ignore_kit(self, kit: Inventory):
         return not (Weapon in kit or Tool in kit)
 
+    def ignore_kits(self, kits: NDArray[Shape["*,36"], Int], masks: NDArray[Shape["*"], Int]) \
+            -> NDArray[Shape["*"], Bool]:
+        return (masks & _WEAPON_OR_TOOL) == 0
+
     def predict(self, kit: Inventory, item: Category) -> NDArray[Shape["9"], Float]:
-        arr = self.chances[item]
+        arr = self.chances.get(item, np.zeros(shape=9, dtype=float))
         total = np.sum(arr)
         # We have preferences matching for this case, return those
         if total != 0:
@@ -96,24 +312,38 @@ class NaiveBayesPredictor1(KitPredictor):
         # No preferences for this use-case, create dummy. Assume you WANT the default position(s).
         return np.array([1 if ki == item else 0 for i, ki in zip(range(0, 9), kit.items)], dtype=float)
 
+    def predict_batch(self, kits: NDArray[Shape["*,36"], Int], items: NDArray[Shape["*"], Int]) \
+            -> NDArray[Shape["*,9"], Float]:
+        empty = np.zeros(shape=9, dtype=float)
+        arr = np.array([self.chances.get(item, empty) for item in Categories.ofCodes(items)]).reshape(-1, 9)
+        total = np.sum(arr, axis=1)
+        known = total != 0
+        return np.where(known[:, None], arr / np.where(known, total, 1)[:, None], _default_positions(kits, items))
+
+    @timed()
     def learn(self, kit: Inventory, pref: Inventory) -> None:
+        self.revision += 1
         for i, ki, pi in zip(range(0, 9), kit.items, pref.items):
             if pi is not None:
-                self.chances[pi][i] += 1
+                self.chances.setdefault(pi, np.zeros(shape=9, dtype=float))[i] += 1
 
 
 class NaiveBayesPredictor2(KitPredictor):
+    __slots__ = ("chances",)
 
-    def __init__(self) -> None:
-        super().__init__()
-        self.chances: Dict[Category, NDArray[Shape["2,9"], Float]] = \
-            defaultdict(lambda: np.zeros(shape=(2, 9), dtype=float))
+    def __init__(self, cache_size: int = 0, assignment: Callable = greedy_assignment) -> None:
+        super().__init__(cache_size, assignment)
+        self.chances: Dict[Category, NDArray[Shape["2,9"], Float]] = {}
 
     def ignore_kit(self, kit: Inventory):
         return not (Weapon in kit or Tool in kit)
 
+    def ignore_kits(self, kits: NDArray[Shape["*,36"], Int], masks: NDArray[Shape["*"], Int]) \
+            -> NDArray[Shape["*"], Bool]:
+        return (masks & _WEAPON_OR_TOOL) == 0
+
     def predict(self, kit: Inventory, item: Category) -> NDArray[Shape["9"], Float]:
-        mat = self.chances[item]
+        mat = self.chances.get(item, np.zeros(shape=(2, 9), dtype=float))
         arr = np.array([mat[0 if ki == item else 1][i] for i, ki in zip(range(0, 9), kit.items)])
         total = np.sum(arr)
         # We have preferences matching for this case, return those
@@ -122,46 +352,200 @@ class NaiveBayesPredictor2(KitPredictor):
         # No preferences for this use-case, create dummy. Assume you WANT the default position(s).
         return np.array([1 if ki == item else 0 for i, ki in zip(range(0, 9), kit.items)], dtype=float)
 
+    def predict_batch(self, kits: NDArray[Shape["*,36"], Int], items: NDArray[Shape["*"], Int]) \
+            -> NDArray[Shape["*,9"], Float]:
+        empty = np.zeros(shape=(2, 9), dtype=float)
+        mat = np.array([self.chances.get(item, empty) for item in Categories.ofCodes(items)]).reshape(-1, 2, 9)
+        arr = np.where(kits[:, 0:9] == items[:, None], mat[:, 0, :], mat[:, 1, :])
+        total = np.sum(arr, axis=1)
+        known = total != 0
+        return np.where(known[:, None], arr / np.where(known, total, 1)[:, None], _default_positions(kits, items))
+
+    @timed()
     def learn(self, kit: Inventory, pref: Inventory) -> None:
+        self.revision += 1
         for i, ki, pi in zip(range(0, 9), kit.items, pref.items):
             if pi is not None:
-                self.chances[pi][0 if ki == pi else 1][i] += 1
+                self.chances.setdefault(pi, np.zeros(shape=(2, 9), dtype=float))[0 if ki == pi else 1][i] += 1
 
 
 class NaiveBayesPredictor3(KitPredictor):
-
-    def __init__(self) -> None:
-        super().__init__()
-        self.chances: Dict[Category, NDArray[Shape["10,9"], Float]] = \
-            defaultdict(lambda: np.zeros(shape=(10, 9), dtype=float))
+    __slots__ = ("codes", "counts")
+    # Version 2 stores counts as float32 (moves can be split in fractions, so they're not always whole numbers)
+    MODEL_VERSION = 2
+    COUNT_DTYPE = np.dtype(np.float32)
+    # Serialized state, one record per category that has been moved
+    STATE_DTYPE = np.dtype([("code", Categories.CODE_DTYPE), ("counts", COUNT_DTYPE, (10, 9))])
+
+    def __init__(self, cache_size: int = 0, assignment: Callable = greedy_assignment) -> None:
+        super().__init__(cache_size, assignment)
+        # Sparse move counts, only for the categories that have been moved: their codes (sorted), and for each of them
+        # the counts from kit slot (0-8, or 9 for any slot outside hotbar) to hotbar slot
+        self.codes: NDArray[Shape["*"], Int] = np.zeros(shape=0, dtype=Categories.CODE_DTYPE)
+        self.counts: NDArray[Shape["*,10,9"], Float] = np.zeros(shape=(0, 10, 9), dtype=self.COUNT_DTYPE)
+
+    @property
+    def chances(self) -> Dict[Category, NDArray[Shape["10,9"], Float]]:
+        return {Categories.from_code(int(code)): counts for code, counts in zip(self.codes, self.counts)}
+
+    def dense_counts(self) -> NDArray[Shape["*,10,9"], Float]:
+        """
+        Move counts as a [categories, 10, 9] tensor indexed by category code, zeros for the categories never moved
+        """
+        dense = np.zeros(shape=(max(len(Categories.CATEGORY_LIST), int(np.max(self.codes, initial=0))) + 1, 10, 9),
+                         dtype=float)
+        dense[self.codes] = self.counts
+        return dense
+
+    def get_state(self) -> np.ndarray:
+        """
+        Compact state of the model, as a STATE_DTYPE record array with only the categories that have been moved
+        """
+        state = np.zeros(shape=len(self.codes), dtype=self.STATE_DTYPE)
+        state["code"] = self.codes
+        state["counts"] = self.counts
+        return state
+
+    def set_state(self, state: np.ndarray) -> None:
+        """
+        Replace the model state with one from get_state. Read only states (like memory-mapped snapshots) are used in
+        place, and only copied once the model learns. Other states are copied.
+        """
+        self.revision += 1
+        codes, counts = state["code"], state["counts"]
+        if state.flags.writeable or counts.dtype != self.COUNT_DTYPE or np.any(codes[1:] <= codes[:-1]):
+            order = np.argsort(codes, kind="stable")
+            codes = np.array(codes[order], dtype=Categories.CODE_DTYPE)
+            counts = np.array(counts[order], dtype=self.COUNT_DTYPE)
+        self.codes, self.counts = codes, counts
+
+    def to_bytes(self) -> bytes:
+        """
+        Raw bytes of get_state, 362 bytes per moved category, see of_bytes
+        """
+        return self.get_state().tobytes()
+
+    @classmethod
+    def of_bytes(cls, data: bytes, cache_size: int = 0) -> NaiveBayesPredictor3:
+        """
+        Create a model from the bytes returned by to_bytes
+        """
+        model = cls(cache_size)
+        model.set_state(np.frombuffer(data, dtype=cls.STATE_DTYPE))
+        return model
 
     def ignore_kit(self, kit: Inventory):
         return not (Weapon in kit or Tool in kit)
 
+    def ignore_kits(self, kits: NDArray[Shape["*,36"], Int], masks: NDArray[Shape["*"], Int]) \
+            -> NDArray[Shape["*"], Bool]:
+        return (masks & _WEAPON_OR_TOOL) == 0
+
     def predict(self, kit: Inventory, item: Category) -> NDArray[Shape["9"], Float]:
-        mat = self.chances[item]
-        arr = np.zeros(shape=9, dtype=float)
-        for i, ki in enumerate(kit.items):
-            if ki == item:
-                row = min(i, 9)  # Max row to check is 10th row (idx = 9)
-                total = np.sum(mat[row, :])
-                if total != 0:
-                    arr += (mat[row, :] / total)
-                if i >= 9:  # If 10th row is included we're done
-                    break
+        code = Categories.code_of(item)
+        positions = np.flatnonzero(kit.codes == code)
+        rows = positions[positions < 9]
+        if len(rows) < len(positions):  # Any amount of slots outside the hotbar count as a single 10th row
+            rows = np.append(rows, 9)
+
+        pos = int(np.searchsorted(self.codes, code))
+        moved = pos < len(self.codes) and self.codes[pos] == code
+        mat = self.counts[pos, rows, :].astype(float) if moved else np.zeros(shape=(len(rows), 9))
+        totals = np.sum(mat, axis=1)
+        used = totals != 0
+        arr = np.sum(mat[used] / totals[used, None], axis=0) if np.any(used) else np.zeros(shape=9, dtype=float)
 
         if np.any(arr):
             return arr
         # No preferences for this use-case, create dummy. Assume you WANT the default position(s).
-        return np.array([1 if ki == item else 0 for i, ki in zip(range(0, 9), kit.items)], dtype=float)
+        return (kit.codes[0:9] == code).astype(float)
 
-    def learn(self, kit: Inventory, pref: Inventory) -> None:
-        for i, ki, pi in zip(range(0, 9), kit.items, pref.items):
-            if pi is not None:
-                if ki == pi:
-                    self.chances[pi][i, i] += 1
-                else:
-                    indexes = [min(idx, 9) for idx, it in enumerate(kit.items) if it == pi and it != pref.items[idx]]
-                    for idx in indexes:
-                        self.chances[pi][idx, i] += 1 / len(indexes)
+    def predict_batch(self, kits: NDArray[Shape["*,36"], Int], items: NDArray[Shape["*"], Int]) \
+            -> NDArray[Shape["*,9"], Float]:
+        matches = kits == items[:, None]
+        # Rows of the move matrix to use, the hotbar slots with the item, and a 10th row for any slot outside it
+        rows = np.concatenate([matches[:, 0:9], np.any(matches[:, 9:], axis=1, keepdims=True)], axis=1)
+
+        index = self._index(items)
+        mat = np.zeros(shape=(len(items), 10, 9), dtype=float)
+        mat[index >= 0] = self.counts[index[index >= 0]]
+        totals = np.sum(mat, axis=2)
+        used = rows & (totals != 0)
+        arr = np.sum(np.where(used[:, :, None], mat / np.where(used, totals, 1)[:, :, None], 0), axis=1)
 
+        return np.where(np.any(arr, axis=1)[:, None], arr, _default_positions(kits, items))
+
+    def learn(self, kit: Inventory, pref: Inventory) -> None:
+        # Online path, interleaved with predictions row by row: same counts as learn_batch, without its broadcasting
+        self.revision += 1
+        if not self.counts.flags.writeable:  # Still using a read only state, see set_state
+            self.codes, self.counts = self.codes.copy(), self.counts.copy()
+        kit_codes, pref_codes = kit.codes, pref.codes
+        changed = kit_codes != pref_codes
+        rows = self._index(pref_codes[0:9]).tolist()
+        # Flat view of the (contiguous) counts, scalar updates are much cheaper than indexing the array
+        flat = memoryview(self.counts.reshape(-1))
+
+        for slot, (ki, pi) in enumerate(zip(kit_codes[0:9].tolist(), pref_codes[0:9].tolist())):
+            if pi == 0:
+                continue
+            # Item stayed in place, or was moved from any of the kit slots it may have come from
+            sources = [slot] if ki == pi else np.flatnonzero((kit_codes == pi) & changed).tolist()
+            if not sources:
+                continue
+            if rows[slot] < 0:
+                self._reserve(np.array([pi]))
+                rows = self._index(pref_codes[0:9]).tolist()
+                flat = memoryview(self.counts.reshape(-1))
+            # A move is split evenly between all its possible sources
+            share = 1 if ki == pi else 1 / len(sources)
+            for idx in sources:
+                flat[rows[slot] * 90 + min(idx, 9) * 9 + slot] += share
+
+    @timed()
+    def learn_batch(self, kits: NDArray[Shape["*,36"], Int], prefs: NDArray[Shape["*,36"], Int]) -> None:
+        self.revision += 1
+        kits, prefs = np.asarray(kits), np.asarray(prefs)
+
+        bar_kit, bar_pref = kits[:, 0:9], prefs[:, 0:9]
+        placed = bar_pref != 0
+        kept = placed & (bar_kit == bar_pref)
+        kept_row, kept_slot = np.nonzero(kept)
+        kept_codes = bar_pref[kept_row, kept_slot]
+
+        # Items that were moved, each move is split evenly between all the kit slots the item may have come from
+        sources = (kits[:, None, :] == bar_pref[:, :, None]) & (kits != prefs)[:, None, :] \
+            & (placed & ~kept)[:, :, None]
+        source_count = np.sum(sources, axis=2)
+        row, slot, idx = np.nonzero(sources)
+        moved_codes = bar_pref[row, slot]
+
+        codes = np.concatenate([kept_codes, moved_codes])
+        index = self._index(codes)
+        if np.any(index < 0):
+            self._reserve(codes[index < 0])
+            index = self._index(codes)
+        if not self.counts.flags.writeable:  # Still using a read only state, see set_state
+            self.codes, self.counts = self.codes.copy(), self.counts.copy()
+        # Item stayed in place
+        np.add.at(self.counts, (index[0:len(kept_codes)], kept_slot, kept_slot), 1)
+        # Item was moved
+        np.add.at(self.counts, (index[len(kept_codes):], np.minimum(idx, 9), slot), 1 / source_count[row, slot])
+
+    def _index(self, codes: NDArray[Shape["*"], Int]) -> NDArray[Shape["*"], Int]:
+        """
+        Row of counts for each category code, -1 for the categories never moved
+        """
+        if len(self.codes) == 0:
+            return np.full(shape=len(codes), fill_value=-1, dtype=np.int64)
+        pos = np.minimum(self.codes.searchsorted(codes), len(self.codes) - 1)
+        return np.where(self.codes[pos] == codes, pos, -1)
+
+    def _reserve(self, codes: NDArray[Shape["*"], Int]) -> None:
+        """
+        Add empty counts for categories not moved before, keeping codes sorted
+        """
+        merged = np.union1d(self.codes, codes).astype(Categories.CODE_DTYPE)
+        counts = np.zeros(shape=(len(merged), 10, 9), dtype=self.COUNT_DTYPE)
+        counts[np.searchsorted(merged, self.codes)] = self.counts
+        self.codes, self.counts = merged, counts
@@ -0,0 +1,249 @@
+# Asyncio prediction server for the KitRecommender plugin, with a load generating client.
+#
+# Line based protocol, one request per line, values separated by spaces:
+#   PREDICT <player> <36 serialized items>                      -> OK <9 kit slot indexes, -1 for empty slots>
+#   LEARN <player> <36 serialized items> <36 serialized items>  -> OK
+#   STATS                                                       -> OK requests=<n> p50_ms=<ms> p99_ms=<ms>
+# Errors are answered with ERR <message>. PREDICT answers, for each hotbar slot, which slot of the given kit should be
+# moved there.
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Dict, List, Tuple, Optional, Deque, TYPE_CHECKING
+
+import numpy as np
+
+from items import Categories, Inventory, Material
+from models import KitPredictor, NaiveBayesPredictor3
+
+if TYPE_CHECKING:
+    from nptyping import NDArray, Shape, Int
+
+PREDICT = "PREDICT"
+LEARN = "LEARN"
+STATS = "STATS"
+
+
+def slot_sources(kit: NDArray[Shape["36"], Int], predicted: NDArray[Shape["*"], Int]) -> NDArray[Shape["9"], Int]:
+    """
+    Turn a predicted hotbar (category codes) into the kit slot each hotbar slot should take its item from
+    :param kit: category codes of the kit given
+    :param predicted: category codes predicted for the hotbar
+    :return: for each hotbar slot, the index of the kit slot to take the item from, -1 to leave it empty
+    """
+    sources = np.full(shape=9, fill_value=-1, dtype=int)
+    used = np.zeros(shape=36, dtype=bool)
+    # Items already in place stay there
+    for slot in range(0, 9):
+        if predicted[slot] != 0 and kit[slot] == predicted[slot]:
+            sources[slot] = slot
+            used[slot] = True
+    for slot in range(0, 9):
+        if predicted[slot] != 0 and sources[slot] == -1:
+            candidates = np.flatnonzero((kit == predicted[slot]) & ~used)
+            if len(candidates) > 0:
+                sources[slot] = candidates[0]
+                used[candidates[0]] = True
+    return sources
+
+
+class _PlayerState:
+    def __init__(self, model: KitPredictor):
+        self.model = model
+        self.pending: List[Tuple[str, Tuple[np.ndarray, ...], asyncio.Future]] = []
+        self.scheduled = False
+
+
+class PredictionServer:
+    """
+    Keeps a model per player in memory. Requests for the same player that arrive in the same event loop tick are
+    coalesced: they're handled together, in order, and predictions are batched (see KitPredictor.predict_kits).
+    """
+
+    def __init__(self, model_factory: Callable[[], KitPredictor] = NaiveBayesPredictor3, latency_window: int = 100_000):
+        self.model_factory = model_factory
+        self.players: Dict[str, _PlayerState] = {}
+        self.requests = 0
+        self.latencies: Deque[float] = deque(maxlen=latency_window)
+
+    def stats(self) -> Dict[str, float]:
+        lat = np.array(self.latencies) * 1000 if self.latencies else np.zeros(shape=1)
+        return {"requests": self.requests, "p50_ms": float(np.percentile(lat, 50)),
+                "p99_ms": float(np.percentile(lat, 99))}
+
+    async def predict(self, player: str, serialized: List[int]) -> NDArray[Shape["9"], Int]:
+        return await self._submit(player, PREDICT, (Categories.codesOfSerialized(np.array(serialized)),))
+
+    async def learn(self, player: str, kit: List[int], pref: List[int]) -> None:
+        await self._submit(player, LEARN, (Categories.codesOfSerialized(np.array(kit)),
+                                           Categories.codesOfSerialized(np.array(pref))))
+
+    async def _submit(self, player: str, op: str, args: Tuple[np.ndarray, ...]):
+        state = self.players.get(player)
+        if state is None:
+            state = self.players[player] = _PlayerState(self.model_factory())
+
+        future = asyncio.get_running_loop().create_future()
+        state.pending.append((op, args, future))
+        if not state.scheduled:
+            state.scheduled = True
+            asyncio.get_running_loop().call_soon(self._drain, state)
+        return await future
+
+    @staticmethod
+    def _drain(state: _PlayerState) -> None:
+        state.scheduled = False
+        pending, state.pending = state.pending, []
+
+        # Predictions between two learn requests are done as a single batch
+        batch: List[Tuple[np.ndarray, asyncio.Future]] = []
+
+        def flush():
+            try:
+                kits = np.stack([kit for kit, _ in batch])
+                for (kit, future), predicted in zip(batch, state.model.predict_kits(kits)):
+                    future.set_result(slot_sources(kit, predicted))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            batch.clear()
+
+        for op, args, future in pending:
+            if op == PREDICT:
+                batch.append((args[0], future))
+                continue
+            if batch:
+                flush()
+            try:
+                state.model.learn(Inventory.of_codes(args[0]), Inventory.of_codes(args[1]))
+                future.set_result(None)
+            except Exception as e:
+                future.set_exception(e)
+        if batch:
+            flush()
+
+    async def handle(self, line: str) -> str:
+        parts = line.split()
+        if not parts:
+            return "ERR empty request"
+        if parts[0] == STATS:
+            return "OK " + " ".join("%s=%s" % (k, round(v, 3)) for k, v in self.stats().items())
+        if parts[0] == PREDICT and len(parts) == 2 + 36:
+            return "OK " + " ".join(str(s) for s in await self.predict(parts[1], [int(v) for v in parts[2:]]))
+        if parts[0] == LEARN and len(parts) == 2 + 72:
+            values = [int(v) for v in parts[2:]]
+            await self.learn(parts[1], values[0:36], values[36:72])
+            return "OK"
+        return "ERR invalid request"
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                start = time.perf_counter()
+                try:
+                    response = await self.handle(line.decode())
+                except Exception as e:
+                    response = "ERR " + repr(e)
+                self.requests += 1
+                self.latencies.append(time.perf_counter() - start)
+                writer.write(response.encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 25580, unix: str = None) -> asyncio.AbstractServer:
+        if unix is not None:
+            return await asyncio.start_unix_server(self._serve_client, path=unix)
+        return await asyncio.start_server(self._serve_client, host=host, port=port)
+
+
+def random_kit(rng: np.random.Generator, materials: List[Material]) -> List[int]:
+    kit = [0] * 36
+    for slot in rng.choice(36, size=rng.integers(4, 12), replace=False):
+        kit[slot] = (materials[rng.integers(len(materials))].value << 16) | (1 << 8)
+    return kit
+
+
+async def load_test(host: str = "127.0.0.1", port: int = 25580, unix: str = None, players: int = 64,
+                    rounds: int = 20, seed: int = 0) -> Dict[str, float]:
+    """
+    Simulate whole matches of players starting at once: every round, all players request a prediction at the same
+    time, and then send back their preferences.
+    :return: client side latency stats
+    """
+    rng = np.random.default_rng(seed)
+    materials = [Material.IRON_SWORD, Material.BOW, Material.IRON_PICKAXE, Material.IRON_AXE, Material.GOLDEN_APPLE,
+                 Material.COOKED_BEEF, Material.WOOD, Material.GLASS, Material.ARROW, Material.WATER_BUCKET]
+    kits = [random_kit(rng, materials) for _ in range(8)]
+    latencies: List[float] = []
+
+    async def player(idx: int):
+        name = "player-%d" % idx
+        if unix is not None:
+            reader, writer = await asyncio.open_unix_connection(unix)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+
+        async def request(line: str) -> str:
+            start = time.perf_counter()
+            writer.write(line.encode() + b"\n")
+            await writer.drain()
+            response = (await reader.readline()).decode().strip()
+            latencies.append(time.perf_counter() - start)
+            return response
+
+        local_rng = np.random.default_rng([seed, idx])
+        for _ in range(rounds):
+            kit = kits[local_rng.integers(len(kits))]
+            await request(PREDICT + " " + name + " " + " ".join(map(str, kit)))
+            pref = list(kit)
+            a, b = local_rng.integers(0, 9, size=2)
+            pref[a], pref[b] = pref[b], pref[a]
+            await request(LEARN + " " + name + " " + " ".join(map(str, kit + pref)))
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[player(i) for i in range(players)])
+    elapsed = time.perf_counter() - start
+
+    lat = np.array(latencies) * 1000
+    return {"requests": len(latencies), "seconds": elapsed, "requests_per_s": len(latencies) / elapsed,
+            "p50_ms": float(np.percentile(lat, 50)), "p99_ms": float(np.percentile(lat, 99))}
+
+
+async def _bench(args) -> None:
+    prediction_server: Optional[PredictionServer] = None
+    server: Optional[asyncio.AbstractServer] = None
+    if not args.external:
+        prediction_server = PredictionServer()
+        server = await prediction_server.start(args.host, args.port, args.unix)
+    print("client:", await load_test(args.host, args.port, args.unix, args.players, args.rounds))
+    if server is not None:
+        print("server:", prediction_server.stats())
+        server.close()
+        await server.wait_closed()
+
+
+async def _serve(args) -> None:
+    server = await PredictionServer().start(args.host, args.port, args.unix)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kit prediction server")
+    parser.add_argument("mode", choices=["serve", "bench"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=25580)
+    parser.add_argument("--unix", default=None, help="unix socket path, instead of tcp")
+    parser.add_argument("--players", type=int, default=64, help="bench: concurrent players")
+    parser.add_argument("--rounds", type=int, default=20, help="bench: matches each player plays")
+    parser.add_argument("--external", action="store_true", help="bench: use an already running server")
+    arguments = parser.parse_args()
+    asyncio.run(_serve(arguments) if arguments.mode == "serve" else _bench(arguments))
@@ -1,3 +1,30 @@
-from .utils import read_file, split_datasets, as_kit_type, count_kits, print_kit_counter, display_changes
-from .plots import plot_player_sizes, plot_kit_sizes
+import importlib
+
+from .utils import read_file, read_codes, read_item_table, decode_codes, serialized_items, read_batches, iter_blocks, \
+    iter_rows, item_keys, split_datasets, as_kit_type, kit_type, kit_types, count_kit_ids, count_kits, \
+    print_kit_counter, display_changes
+from .dataset import consolidate_dataset, read_dataset, read_player, dataset_players
+from .decoded_cache import DecodedCache, enable_decoded_cache
+from .manifest import build_manifest, manifest_view, row_count
+from .kit_registry import KitTypeRegistry, first_appearance_ids
+from .metrics import kit_diffs, player_averages, dataset_diffs
 from .scatter_hist import show_scatter_hists, show_kit_scatter_hists, compute_kit_modifications
+from .prune import prune_dataset, prune_file, CommonKits
+from .evaluation import evaluate_models, evaluate_player, model_errors
+from .snapshots import SnapshotStore
+from .results import ResultsStore
+from .move_matrix import aggregate_move_matrix, load_move_matrix
+from .synthetic import generate_dataset
+
+# Plotting pulls in matplotlib, which is slow to import, so plot functions are only imported when first used
+_LAZY = {"plot_player_sizes": ".plots", "plot_kit_sizes": ".plots"}
+
+__all__ = [name for name in globals() if not name.startswith("_") and name != "importlib"] + list(_LAZY)
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = globals()[name] = getattr(importlib.import_module(module, __name__), name)
+    return value
@@ -0,0 +1,108 @@
+# Consolidated datasets: all players in a single parquet file, instead of one file per player
+import os
+from typing import Dict, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pds
+import pyarrow.parquet as pq
+
+PLAYER_COLUMN = "player"
+ROWS_COLUMN = "player_rows"
+
+
+def consolidate_dataset(source: str = "kit_data/all", dest: str = "kit_data/all.parquet",
+                        row_group_size: int = 64 * 1024) -> int:
+    """
+    Merge a directory with one parquet file per player into a single parquet file. Rows are sorted by player (keeping
+    the original order for each player), and tagged with the player and the amount of rows the player has, so that
+    row group statistics let readers skip everything but the players they want.
+    :param source: source dataset, a directory with one file per player
+    :param dest: path of the consolidated parquet file to write
+    :param row_group_size: rows to buffer before writing a row group
+    :return: amount of players written
+    """
+    writer = None
+    pending: List[pa.Table] = []
+    pending_rows = 0
+    players = 0
+
+    try:
+        for user in sorted(os.listdir(source)):
+            table = pq.read_table(source + "/" + user).replace_schema_metadata(None)
+            if "__index_level_0__" in table.column_names:
+                table = table.drop(["__index_level_0__"])
+            table = table \
+                .append_column(PLAYER_COLUMN, pa.array([player_name(user)] * table.num_rows, type=pa.string())) \
+                .append_column(ROWS_COLUMN, pa.array([table.num_rows] * table.num_rows, type=pa.int32()))
+
+            if writer is None:
+                writer = pq.ParquetWriter(dest, table.schema)
+            pending.append(table)
+            pending_rows += table.num_rows
+            players += 1
+
+            if pending_rows >= row_group_size:
+                writer.write_table(pa.concat_tables(pending), row_group_size=row_group_size)
+                pending, pending_rows = [], 0
+
+        if writer is not None and pending:
+            writer.write_table(pa.concat_tables(pending), row_group_size=row_group_size)
+    finally:
+        if writer is not None:
+            writer.close()
+    return players
+
+
+def player_name(file: str) -> str:
+    """
+    Player name (uuid) for a per-player dataset file
+    """
+    return os.path.basename(file).removesuffix(".parquet")
+
+
+def dataset_filter(min_rows: int = None, players: List[str] = None) -> pds.Expression:
+    """
+    Build a predicate selecting a subset of a consolidated dataset
+    :param min_rows: only players with at least this many rows, equivalent to the min_N directories
+    :param players: only these players
+    """
+    expr = None
+    if min_rows is not None:
+        expr = pc.field(ROWS_COLUMN) >= min_rows
+    if players is not None:
+        player_expr = pc.field(PLAYER_COLUMN).isin(players)
+        expr = player_expr if expr is None else expr & player_expr
+    return expr
+
+
+def read_dataset(path: str, min_rows: int = None, players: List[str] = None, columns: List[str] = None) -> pa.Table:
+    """
+    Read (a subset of) a consolidated dataset. Filtering on an already pruned dataset (eg: filtered_10) by min_rows
+    gives the same rows as the filtered_N directories.
+    :param path: consolidated parquet file
+    :param min_rows: only players with at least this many rows
+    :param players: only these players
+    :param columns: columns to read, all by default
+    """
+    return pds.dataset(path, format="parquet").to_table(columns=columns, filter=dataset_filter(min_rows, players))
+
+
+def read_player(path: str, player: str) -> pd.DataFrame:
+    """
+    Read the rows for a single player, with the same shape the per-player files had
+    """
+    df = read_dataset(path, players=[player]).drop([PLAYER_COLUMN, ROWS_COLUMN]).to_pandas()
+    df.index = range(df.shape[0])
+    return df
+
+
+def dataset_players(path: str, min_rows: int = None) -> Dict[str, int]:
+    """
+    Players in a consolidated dataset, with their row count, sorted by player
+    """
+    table = read_dataset(path, min_rows=min_rows, columns=[PLAYER_COLUMN, ROWS_COLUMN]) \
+        .group_by([PLAYER_COLUMN, ROWS_COLUMN]).aggregate([]) \
+        .sort_by(PLAYER_COLUMN)
+    return dict(zip(table[PLAYER_COLUMN].to_pylist(), table[ROWS_COLUMN].to_pylist()))
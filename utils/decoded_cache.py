@@ -0,0 +1,116 @@
+# On-disk cache of decoded datasets: the category codes of each file, saved as .npy and loaded memory-mapped
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional, Dict, Callable, IO
+
+import numpy as np
+
+from items import Categories
+
+# Bump when decoding changes, to invalidate everything cached with the previous version
+DECODER_VERSION = 1
+# Directory of the cache used by read_codes & read_file, inherited by worker processes
+CACHE_ENV = "KIT_DECODED_CACHE"
+
+
+class DecodedCache:
+    """
+    Directory with a (rows x 72) .npy matrix of category codes for each source file (kit codes, then sorted codes), and
+    a .json file with what it was decoded from. Entries are only used while the source file has the same size & mtime
+    and were decoded with the same decoder version and category mapping (see Categories.fingerprint).
+    """
+
+    def __init__(self, directory: str = "decoded_cache"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, file: str) -> str:
+        return self.directory + "/" + hashlib.sha1(os.path.abspath(file).encode()).hexdigest()
+
+    @staticmethod
+    def source_meta(file: str) -> Dict[str, object]:
+        """
+        What an entry for a file is valid for. Take it before reading the file, so a file rewritten while it's being
+        decoded is never cached under its new size & mtime.
+        """
+        stat = os.stat(file)
+        return {"source": os.path.abspath(file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                "decoder": DECODER_VERSION, "categories": Categories.fingerprint()}
+
+    def load(self, file: str) -> Optional[np.ndarray]:
+        """
+        Get the cached codes of a file, memory-mapped (read only, no copy)
+        :return: (rows x 72) matrix of category codes, None if there's no valid entry
+        """
+        path = self._path(file)
+        try:
+            with open(path + ".json", "r") as f:
+                meta = json.load(f)
+            if any(meta.get(k) != v for k, v in self.source_meta(file).items()):
+                return None
+            if meta["rows"] == 0:
+                return np.zeros(shape=(0, 72), dtype=Categories.CODE_DTYPE)
+            return np.load(path + ".npy", mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _replace(self, dest: str, write: Callable[[IO], None], mode: str = "wb") -> None:
+        # Unique temp file, several processes may be caching the same file at once
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp, dest)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def store(self, file: str, codes: np.ndarray, meta: Optional[Dict[str, object]] = None) -> np.ndarray:
+        """
+        Cache the codes decoded from a file
+        :param codes: (rows x 72) matrix of category codes
+        :param meta: source_meta of the file, taken before reading it. Defaults to the file as it is now
+        :return: the cached codes, memory-mapped
+        """
+        meta = self.source_meta(file) if meta is None else meta
+        path = self._path(file)
+        codes = np.asarray(codes, dtype=Categories.CODE_DTYPE)
+        self._replace(path + ".npy", lambda f: np.save(f, codes))
+        # Written last, so a valid entry always has its codes in place
+        self._replace(path + ".json", lambda f: json.dump(dict(meta, rows=len(codes)), f), "w")
+        return np.load(path + ".npy", mmap_mode="r") if len(codes) > 0 else codes
+
+    def clear(self) -> None:
+        for name in os.listdir(self.directory):
+            os.remove(self.directory + "/" + name)
+
+
+_cache: Optional[DecodedCache] = None
+
+
+def enable_decoded_cache(directory: Optional[str] = "decoded_cache") -> Optional[DecodedCache]:
+    """
+    Make read_codes and read_file (with only_category=True) go through an on-disk cache of decoded files
+    :param directory: cache directory, None to disable the cache
+    """
+    global _cache
+    if directory is None:
+        os.environ.pop(CACHE_ENV, None)
+        _cache = None
+    else:
+        os.environ[CACHE_ENV] = directory
+        _cache = DecodedCache(directory)
+    return _cache
+
+
+def decoded_cache() -> Optional[DecodedCache]:
+    """
+    The cache enabled with enable_decoded_cache (or through the KIT_DECODED_CACHE environment variable), if any
+    """
+    global _cache
+    directory = os.environ.get(CACHE_ENV)
+    if _cache is None and directory:
+        _cache = DecodedCache(directory)
+    return _cache
@@ -0,0 +1,67 @@
+# Evaluate kit predictors over whole datasets
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Type, Sequence
+
+import numpy as np
+from nptyping import NDArray, Shape, Float, Int
+
+from instrumentation import timed, profile, count, task, task_result
+from items import Inventory, Categories
+from models import KitPredictor
+from utils import read_codes
+
+
+@timed()
+def model_errors(kits: NDArray[Shape["*,36"], Int], prefs: NDArray[Shape["*,36"], Int],
+                 model_cls: Type[KitPredictor]) -> NDArray[Shape["*"], Float]:
+    """
+    Replay a player's history on a fresh model, predicting each kit before learning from it
+    :param kits: (rows x 36) matrix of category codes for the kits given
+    :param prefs: (rows x 36) matrix of category codes for the kits as sorted by the player
+    :param model_cls: predictor class to evaluate
+    :return: the prediction error for each row
+    """
+    predictor: KitPredictor = model_cls()
+    predicted = np.zeros(shape=(len(kits), 9), dtype=Categories.CODE_DTYPE)
+
+    for idx, (kit_codes, pref_codes) in enumerate(zip(kits, prefs)):
+        kit = Inventory.of_codes(kit_codes)
+        pref = Inventory.of_codes(pref_codes)
+
+        predicted[idx] = predictor.predict_kit(kit).codes[0:9]
+        predictor.learn(kit, pref)
+
+    return predictor.calculate_diffs(predicted, prefs)
+
+
+def evaluate_player(file: str, model_classes: Sequence[Type[KitPredictor]]) -> NDArray[Shape["*"], Float]:
+    """
+    Average error of each model for a single player, the file is only read & decoded once
+    """
+    with profile(file):
+        kits, prefs = read_codes(file)
+        count("players_evaluated")
+        return np.array([np.average(model_errors(kits, prefs, model_cls)) for model_cls in model_classes])
+
+
+@timed()
+def evaluate_models(ds: str, model_classes: Sequence[Type[KitPredictor]], max_workers: int = None,
+                    chunk_size: int = 8) -> NDArray[Shape["*,*"], Float]:
+    """
+    Evaluate a list of models over every player in a dataset, spreading players across processes
+    :param ds: dataset directory, with a parquet file per player
+    :param model_classes: predictor classes to evaluate, must be importable by worker processes
+    :param max_workers: amount of worker processes, defaults to the cpu count
+    :param chunk_size: amount of players sent to a worker at once
+    :return: a (players x models) matrix with the average error, players in os.listdir order
+    """
+    files: List[str] = [ds + "/" + player for player in os.listdir(ds)]
+    model_classes = list(model_classes)
+    result = np.zeros(shape=(len(files), len(model_classes)), dtype=float)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for idx, errors in enumerate(executor.map(task(evaluate_player), files, [model_classes] * len(files),
+                                                  chunksize=chunk_size)):
+            result[idx] = task_result(errors)
+    return result
@@ -0,0 +1,139 @@
+# Dense integer ids for kit types, so counters & group-bys can index arrays instead of hashing kits
+import json
+import os
+from typing import Optional, List, Tuple, Iterable
+
+import numpy as np
+from nptyping import NDArray, Shape, Int
+
+from items import Categories, Inventory
+
+
+def row_keys(rows: np.ndarray) -> np.ndarray:
+    """
+    One opaque, sortable key per row of a (rows x 36) category code matrix, rows with the same codes get the same key
+    """
+    rows = np.ascontiguousarray(rows, dtype=Categories.CODE_DTYPE)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+
+
+def first_appearance_ids(keys: np.ndarray) -> Tuple[NDArray[Shape["*"], Int], NDArray[Shape["*"], Int]]:
+    """
+    Dense ids for the distinct values (or rows, for 2d arrays) of keys, numbered in order of first appearance
+    :return: the id of each value, and the index of the first appearance of each id
+    """
+    if keys.ndim == 2:
+        keys = np.ascontiguousarray(keys).view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty(shape=len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank[inverse.ravel()], first[order]
+
+
+def kit_types(kits: np.ndarray) -> np.ndarray:
+    """
+    Canonical kit types for a whole block of kits: the distinct categories in each kit, sorted, and padded with 0's
+    :param kits: (rows x 36) matrix of category codes
+    :return: (rows x 36) matrix with the category codes for the kit type of each row
+    """
+    ranks = Categories.sort_ranks()
+    empty = len(ranks) - 1
+    kit_ranks = np.sort(ranks[kits], axis=1)
+    # Remove duplicates by marking them empty (sorting last), and re-sort so they're moved to the end
+    kit_ranks[:, 1:][kit_ranks[:, 1:] == kit_ranks[:, :-1]] = empty
+    kit_ranks.sort(axis=1)
+    return np.argsort(ranks).astype(Categories.CODE_DTYPE)[kit_ranks]
+
+
+class KitTypeRegistry:
+    """
+    Interns kit types (see kit_types): each distinct kit type gets a stable id, numbered from 0 in order of first
+    appearance. Ids are never reused, and can be persisted (<path>.npy with the kit types by id, <path>.json with the
+    category mapping they're valid for).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.types: NDArray[Shape["*,36"], Int] = np.zeros(shape=(0, 36), dtype=Categories.CODE_DTYPE)
+        if path is not None:
+            try:
+                with open(path + ".json", "r") as f:
+                    if json.load(f).get("categories") == Categories.fingerprint():
+                        self.types = np.load(path + ".npy")
+            except (OSError, ValueError):
+                pass
+        self._reindex()
+
+    def _reindex(self) -> None:
+        keys = row_keys(self.types)
+        self._order = np.argsort(keys, kind="stable")
+        self._sorted = keys[self._order]
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def lookup(self, types: NDArray[Shape["*,36"], Int]) -> NDArray[Shape["*"], Int]:
+        """
+        Ids of already registered kit types
+        :param types: (rows x 36) matrix of kit types, as returned by kit_types
+        :return: the id of each row, -1 for unknown kit types
+        """
+        keys = row_keys(types)
+        if len(self._sorted) == 0:
+            return np.full(shape=len(keys), fill_value=-1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted, keys), len(self._sorted) - 1)
+        return np.where(self._sorted[pos] == keys, self._order[pos], -1)
+
+    def intern(self, types: NDArray[Shape["*,36"], Int]) -> NDArray[Shape["*"], Int]:
+        """
+        Ids of kit types, registering the unknown ones
+        :param types: (rows x 36) matrix of kit types, as returned by kit_types
+        :return: the id of each row
+        """
+        ids = self.lookup(types)
+        missing = np.flatnonzero(ids < 0)
+        if len(missing) > 0:
+            new_ids, first = first_appearance_ids(row_keys(types[missing]))
+            ids[missing] = len(self.types) + new_ids
+            self.types = np.concatenate([self.types, np.asarray(types, dtype=Categories.CODE_DTYPE)[missing[first]]])
+            self._reindex()
+        return ids
+
+    def intern_kits(self, kits: Iterable[Inventory]) -> NDArray[Shape["*"], Int]:
+        """
+        Ids of kit types given as inventories (like count_kits keys), registering the unknown ones
+        """
+        kits = list(kits)
+        types = np.zeros(shape=(len(kits), 36), dtype=Categories.CODE_DTYPE)
+        for idx, kit in enumerate(kits):
+            types[idx, 0:len(kit.codes)] = kit.codes
+        return self.intern(types)
+
+    def ids(self, kits: NDArray[Shape["*,36"], Int], add: bool = True) -> NDArray[Shape["*"], Int]:
+        """
+        Kit type id of each kit
+        :param kits: (rows x 36) matrix of category codes
+        :param add: True to register unknown kit types, False to get -1 for them
+        """
+        types = kit_types(kits)
+        return self.intern(types) if add else self.lookup(types)
+
+    def kit(self, kit_id: int) -> Inventory:
+        """
+        Kit type with the given id, like kit_type returns them
+        """
+        codes = self.types[kit_id]
+        return Inventory.of_codes(codes[codes != 0].copy())
+
+    def kits(self) -> List[Inventory]:
+        return [self.kit(kit_id) for kit_id in range(len(self.types))]
+
+    def save(self, path: Optional[str] = None) -> None:
+        path = self.path if path is None else path
+        with open(path + ".npy.tmp", "wb") as f:
+            np.save(f, self.types)
+        os.replace(path + ".npy.tmp", path + ".npy")
+        with open(path + ".json.tmp", "w") as f:
+            json.dump({"categories": Categories.fingerprint(), "kit_types": len(self.types)}, f)
+        os.replace(path + ".json.tmp", path + ".json")
@@ -0,0 +1,83 @@
+# Cached listing of a per-player dataset directory, to avoid re-opening every file each time it's split or counted
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, NamedTuple, List
+
+import pyarrow.parquet as pq
+
+
+class ManifestEntry(NamedTuple):
+    size: int
+    mtime_ns: int
+    rows: int
+
+
+def manifest_path(source: str) -> str:
+    """
+    Path of the manifest for a dataset directory. It lives next to the directory, so listing the dataset is unaffected
+    """
+    return source.rstrip("/") + ".manifest.json"
+
+
+def row_count(file: str) -> int:
+    """
+    Read the row count in a parquet file, from the footer metadata only
+    """
+    return pq.ParquetFile(file).metadata.num_rows
+
+
+def load_manifest(source: str) -> Dict[str, ManifestEntry]:
+    try:
+        with open(manifest_path(source), "r") as f:
+            return {name: ManifestEntry(*entry) for name, entry in json.load(f).items()}
+    except (OSError, ValueError, TypeError):
+        return {}
+
+
+def save_manifest(source: str, manifest: Dict[str, ManifestEntry]) -> None:
+    path = manifest_path(source)
+    with open(path + ".tmp", "w") as f:
+        json.dump({name: list(entry) for name, entry in manifest.items()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def build_manifest(source: str, max_workers: int = 32) -> Dict[str, ManifestEntry]:
+    """
+    Get the manifest (size, mtime and row count of each file) for a dataset directory. The persisted manifest is
+    reused for files with unchanged size & mtime, only new or changed files have their parquet footer read.
+    :param source: dataset directory
+    :param max_workers: threads used to read footers
+    :return: manifest entries by file name, in directory listing order
+    """
+    cached = load_manifest(source)
+    manifest: Dict[str, ManifestEntry] = {}
+    stale: List[os.DirEntry] = []
+
+    with os.scandir(source) as it:
+        for entry in it:
+            stat = entry.stat()
+            old = cached.get(entry.name)
+            if old is not None and old.size == stat.st_size and old.mtime_ns == stat.st_mtime_ns:
+                manifest[entry.name] = old
+            else:
+                manifest[entry.name] = None
+                stale.append(entry)
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            counts = executor.map(lambda e: row_count(e.path), stale)
+            for entry, rows in zip(stale, counts):
+                stat = entry.stat()
+                manifest[entry.name] = ManifestEntry(stat.st_size, stat.st_mtime_ns, rows)
+
+    if stale or manifest.keys() != cached.keys():
+        save_manifest(source, manifest)
+    return manifest
+
+
+def manifest_view(source: str, min_rows: int = 0) -> List[str]:
+    """
+    Files in a dataset with at least min_rows rows, a view equivalent to the split min_N directories
+    """
+    return [source + "/" + name for name, entry in build_manifest(source).items() if entry.rows >= min_rows]
@@ -0,0 +1,74 @@
+# Vectorized kit edition metrics, over whole matrices of kits instead of row by row
+import os
+from typing import Tuple, List
+
+import numpy as np
+from nptyping import NDArray, Shape, Int, Float
+
+from instrumentation import timed
+from .utils import iter_blocks, item_keys
+
+
+def kit_diffs(kits: NDArray[Shape["*,36"], Int], sorts: NDArray[Shape["*,36"], Int]) \
+        -> Tuple[NDArray[Shape["*"], Float], NDArray[Shape["*"], Float]]:
+    """
+    How much each kit was edited, with the same semantics as scatter_hist.compute_diff. A slot counts as edited when it
+    held an item in the kit, and the sorted kit has nothing or something else there.
+    :param kits: (rows x 36) matrix of item keys (category codes or item_keys), 0 for empty slots
+    :param sorts: (rows x 36) matrix of item keys for the sorted kits
+    :return: kit_diff, the fraction of items moved in the whole kit (0 for empty kits), and bar_diff, the fraction of
+    items moved in the hotbar (only set when the last hotbar slot holds an item, 0 otherwise)
+    """
+    present = kits != 0
+    edited = present & (kits != sorts)
+
+    items = np.count_nonzero(present, axis=1)
+    kit_diff = np.divide(np.count_nonzero(edited, axis=1), items, out=np.zeros(shape=len(kits)), where=items > 0)
+
+    bar_items = np.count_nonzero(present[:, 0:9], axis=1)
+    bar_diff = np.divide(np.count_nonzero(edited[:, 0:9], axis=1), bar_items, out=np.zeros(shape=len(kits)),
+                         where=present[:, 8])
+    return kit_diff, bar_diff
+
+
+def player_averages(players: NDArray[Shape["*"], Int], kit_diff: NDArray[Shape["*"], Float],
+                    bar_diff: NDArray[Shape["*"], Float], n_players: int = None) -> NDArray[Shape["*,4"], Float]:
+    """
+    Aggregate per-row kit_diffs per player
+    :param players: player index of each row
+    :param n_players: amount of players, defaults to the highest index + 1
+    :return: (players x 4) matrix with the average kit_diff, the average bar_diff, and how often the kit and the hotbar
+    were edited at all
+    """
+    if n_players is None:
+        n_players = int(np.max(players)) + 1 if len(players) > 0 else 0
+    rows = np.bincount(players, minlength=n_players)
+    sums = np.column_stack([np.bincount(players, weights=values, minlength=n_players)
+                            for values in (kit_diff, bar_diff, kit_diff > 0, bar_diff > 0)])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / rows[:, None]
+
+
+def file_diffs(file: str) -> Tuple[NDArray[Shape["*"], Float], NDArray[Shape["*"], Float]]:
+    """
+    kit_diffs of every row in a parquet file, comparing the item stacks themselves (not only their category)
+    """
+    blocks = [kit_diffs(item_keys(kits), item_keys(sorts)) for kits, sorts in iter_blocks(file, decode=False)]
+    if not blocks:
+        return np.zeros(shape=0), np.zeros(shape=0)
+    return np.concatenate([kit for kit, _ in blocks]), np.concatenate([bar for _, bar in blocks])
+
+
+@timed()
+def dataset_diffs(ds: str) -> NDArray[Shape["*,4"], Float]:
+    """
+    Per player edition stats for a whole dataset, see player_averages
+    :param ds: dataset directory, with a parquet file per player
+    :return: (players x 4) matrix, players in os.listdir order
+    """
+    files: List[str] = os.listdir(ds)
+    diffs = [file_diffs(ds + "/" + user) for user in files]
+    players = np.repeat(np.arange(len(files)), [len(kit) for kit, _ in diffs])
+    kit_diff = np.concatenate([kit for kit, _ in diffs]) if diffs else np.zeros(shape=0)
+    bar_diff = np.concatenate([bar for _, bar in diffs]) if diffs else np.zeros(shape=0)
+    return player_averages(players, kit_diff, bar_diff, len(files))
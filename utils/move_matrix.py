@@ -0,0 +1,75 @@
+# Aggregate the NaiveBayesPredictor3 move matrices of all players in a dataset
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict
+
+import numpy as np
+from nptyping import NDArray, Shape, Float
+
+from instrumentation import task, task_result
+from items import Categories, Category
+from models import NaiveBayesPredictor3
+from utils import iter_blocks
+
+
+def shard_move_counts(files: List[str]) -> NDArray[Shape["*,10,9"], Float]:
+    """
+    Summed move counts for a shard of players. Counts are additive, so summing one model per player is the same as
+    learning every player's rows in one model, but the sum is kept in float64 instead of the float32 model counts.
+    """
+    total = np.zeros(shape=(len(Categories.CATEGORY_LIST) + 1, 10, 9), dtype=float)
+    for file in files:
+        model = NaiveBayesPredictor3()
+        for kits, prefs in iter_blocks(file):
+            model.learn_batch(kits, prefs)
+        counts = model.dense_counts()
+        if len(counts) > len(total):
+            counts, total = total, counts
+        total[0:len(counts)] += counts
+    return total
+
+
+def aggregate_move_matrix(ds: str = "kit_data/filtered_200", dest: str = "move_matrix.npy", max_workers: int = None,
+                          shard_size: int = 64) -> Dict[Category, NDArray[Shape["10,9"], Float]]:
+    """
+    Sum the move matrices of every player in a dataset, sharding players across processes. The result is written as a
+    [categories, 10, 9] .npy tensor indexed by category code, with the category names by code in <dest>.json
+    :param ds: dataset directory
+    :param dest: path for the .npy tensor
+    :param max_workers: amount of worker processes, defaults to the cpu count
+    :param shard_size: amount of players per task
+    :return: the move matrix of each moved category, see load_move_matrix
+    """
+    files = [ds + "/" + player for player in os.listdir(ds)]
+    shards = [files[i:i + shard_size] for i in range(0, len(files), shard_size)]
+
+    total = np.zeros(shape=(len(Categories.CATEGORY_LIST) + 1, 10, 9), dtype=float)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for partial in map(task_result, executor.map(task(shard_move_counts), shards)):
+            if len(partial) > len(total):
+                partial, total = total, partial
+            total[0:len(partial)] += partial
+
+    tensor = np.lib.format.open_memmap(dest, mode="w+", dtype=float, shape=total.shape)
+    tensor[:] = total
+    tensor.flush()
+    with open(dest + ".json", "w") as f:
+        json.dump({"categories": [str(Categories.from_code(code)) for code in range(len(total))]}, f)
+    del tensor
+
+    return load_move_matrix(dest)
+
+
+def load_move_matrix(path: str = "move_matrix.npy") -> Dict[Category, NDArray[Shape["10,9"], Float]]:
+    """
+    Load a tensor written by aggregate_move_matrix, memory-mapped
+    :return: the move matrix of each moved category, as views over the memory-mapped tensor
+    """
+    tensor = np.load(path, mmap_mode="r")
+    with open(path + ".json", "r") as f:
+        names = json.load(f)["categories"]
+
+    by_name = {str(cat): cat for cat in Categories.CATEGORY_LIST}
+    moved = np.flatnonzero(np.any(tensor, axis=(1, 2)))
+    return {by_name[names[code]]: tensor[code] for code in moved}
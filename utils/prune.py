@@ -0,0 +1,106 @@
+# Filter the rows of a whole dataset, writing a new dataset with the players that still have enough rows
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Counter, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from nptyping import NDArray, Shape, Int, Bool
+
+from instrumentation import timed, task, task_result
+from items import Inventory
+from .kit_registry import KitTypeRegistry
+from .manifest import ManifestEntry, save_manifest
+from .utils import decode_codes, split_datasets
+
+# Vectorized row filter: given the (rows x 36) category codes of the kits in a file, which rows to keep
+RowFilter = Callable[[NDArray[Shape["*,36"], Int]], NDArray[Shape["*"], Bool]]
+
+
+class CommonKits:
+    """
+    Row filter keeping the kits whose kit type (see kit_types) was given at least min_uses times
+    """
+
+    def __init__(self, kit_counts: Counter[Inventory], min_uses: int = 50, registry: KitTypeRegistry = None):
+        """
+        :param kit_counts: amount of uses of each kit type, as returned by count_kits
+        :param min_uses: minimum amount of uses for a kit type to be kept
+        :param registry: kit type registry to use for the lookups, defaults to a new one
+        """
+        self.registry = KitTypeRegistry() if registry is None else registry
+        ids = self.registry.intern_kits(kit_counts.keys())
+        self.common = np.zeros(shape=len(self.registry), dtype=bool)
+        self.common[ids[np.array(list(kit_counts.values()), dtype=np.int64) >= min_uses]] = True
+
+    def __call__(self, kits: NDArray[Shape["*,36"], Int]) -> NDArray[Shape["*"], Bool]:
+        ids = self.registry.ids(kits, add=False)
+        known = (ids >= 0) & (ids < len(self.common))
+        keep = np.zeros(shape=len(ids), dtype=bool)
+        keep[known] = self.common[ids[known]]
+        return keep
+
+
+def prune_file(src: str, dst: str, row_filter: RowFilter, min_rows: int = 0) -> int:
+    """
+    Write the rows of a player file that pass a filter, if there's at least min_rows of them
+    :return: amount of rows written, 0 if the file was skipped (and any previous dst removed)
+    """
+    table = pq.read_table(src)
+    if table.num_rows >= min_rows:
+        kits, _ = decode_codes(table)
+        table = table.filter(pa.array(row_filter(kits), type=pa.bool_()))
+
+    if table.num_rows < min_rows or table.num_rows == 0:
+        if os.path.lexists(dst):
+            os.remove(dst)
+        return 0
+
+    # Rows are renumbered, drop any stored pandas index
+    table = table.drop([name for name in table.column_names if name.startswith("__index_level_")])
+    pq.write_table(table.replace_schema_metadata(None), dst + ".tmp")
+    os.replace(dst + ".tmp", dst)
+    return table.num_rows
+
+
+@timed()
+def prune_dataset(in_ds: str, out_ds: str, row_filter: RowFilter, min_rows: int = 10, sizes: Optional[List[int]] = None,
+                  dest: Optional[str] = None, max_workers: int = None) -> List[int]:
+    """
+    Filter the rows of every player in a dataset, spreading players across processes. The output directory ends up
+    with exactly the players that have at least min_rows rows left, and gets a manifest so splitting it doesn't need
+    to re-read any file.
+    :param in_ds: source dataset directory
+    :param out_ds: output dataset directory
+    :param row_filter: which rows to keep, must be picklable (eg: CommonKits)
+    :param min_rows: minimum amount of rows for a player to be kept, before and after filtering
+    :param sizes: if set, the output is split with split_datasets for these sizes
+    :param dest: dataset prefix for the splits, defaults to out_ds with its trailing number removed
+    :param max_workers: amount of worker processes, defaults to the cpu count
+    :return: the amount of rows of each player kept
+    """
+    os.makedirs(out_ds, exist_ok=True)
+    users = os.listdir(in_ds)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(task(prune_file), [in_ds + "/" + user for user in users],
+                               [out_ds + "/" + user for user in users], [row_filter] * len(users),
+                               [min_rows] * len(users), chunksize=16)
+        rows = [task_result(result) for result in results]
+
+    kept = {user: count for user, count in zip(users, rows) if count > 0}
+    for existing in os.listdir(out_ds):
+        if existing not in kept:
+            os.remove(out_ds + "/" + existing)
+
+    manifest = {}
+    for user, count in kept.items():
+        stat = os.stat(out_ds + "/" + user)
+        manifest[user] = ManifestEntry(stat.st_size, stat.st_mtime_ns, count)
+    save_manifest(out_ds, manifest)
+
+    if sizes is not None:
+        split_datasets(sizes, out_ds, dest if dest is not None else out_ds.rstrip("/").rstrip("0123456789"),
+                       dry_run=False)
+    return list(kept.values())
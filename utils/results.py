@@ -0,0 +1,114 @@
+# Resumable evaluation results, so long runs survive restarts and new models only need their own column computed
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Sequence, Tuple, Type
+
+import numpy as np
+from nptyping import NDArray, Shape, Float
+
+from instrumentation import task, task_result
+from models import KitPredictor
+from utils.evaluation import evaluate_player
+
+
+def file_hash(file: str) -> str:
+    """
+    Hash of the contents of a file, results stay valid for the same data no matter which dataset it's in
+    """
+    digest = hashlib.sha1()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_key(model_cls: Type[KitPredictor]) -> str:
+    return "%s@%d" % (model_cls.__name__, model_cls.MODEL_VERSION)
+
+
+class ResultsStore:
+    """
+    Append-only store of the average error of each model for each player. Results are keyed by player file name,
+    contents hash and model name & version (see KitPredictor.MODEL_VERSION), and written to a json lines file as soon
+    as each player is done. A line cut short by a crash is ignored.
+    """
+
+    def __init__(self, path: str = "results.jsonl"):
+        self.path = path
+        self.results: Dict[Tuple[str, str, str], float] = {}
+        # Set when the file ends with a cut short line, the next entry then starts on a new line
+        self._partial = False
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    self._partial = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                        self.results[entry["player"], entry["hash"], entry["model"]] = entry["error"]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def _append(self, entries: List[Dict[str, object]]) -> None:
+        with open(self.path, "a") as f:
+            if self._partial:
+                f.write("\n")
+                self._partial = False
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        for entry in entries:
+            self.results[entry["player"], entry["hash"], entry["model"]] = entry["error"]
+
+    def evaluate(self, ds: str, model_classes: Sequence[Type[KitPredictor]], players: List[str] = None,
+                 max_workers: int = None) -> NDArray[Shape["*,*"], Float]:
+        """
+        Evaluate models over a dataset, like evaluate_models, skipping every (player, model) pair already stored
+        :param ds: dataset directory, with a parquet file per player
+        :param model_classes: predictor classes to evaluate, must be importable by worker processes
+        :param players: player files to evaluate, defaults to the whole dataset in os.listdir order
+        :param max_workers: amount of worker processes, defaults to the cpu count
+        :return: a (players x models) matrix with the average error
+        """
+        players = os.listdir(ds) if players is None else players
+        model_classes = list(model_classes)
+        hashes = [file_hash(ds + "/" + player) for player in players]
+
+        pending = []
+        for player, digest in zip(players, hashes):
+            missing = [cls for cls in model_classes if (player, digest, model_key(cls)) not in self.results]
+            if missing:
+                pending.append((player, digest, missing))
+
+        if pending:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                worker = task(evaluate_player)
+                futures = {executor.submit(worker, ds + "/" + player, missing): (player, digest, missing)
+                           for player, digest, missing in pending}
+                for future in as_completed(futures):
+                    player, digest, missing = futures[future]
+                    self._append([{"player": player, "hash": digest, "model": model_key(cls), "error": float(error)}
+                                  for cls, error in zip(missing, task_result(future.result()))])
+
+        return self._matrix(players, hashes, model_classes)
+
+    def matrix(self, ds: str, model_classes: Sequence[Type[KitPredictor]], players: List[str] = None) \
+            -> NDArray[Shape["*,*"], Float]:
+        """
+        Assemble the (players x models) results matrix from stored results only, nan where there's none
+        """
+        players = os.listdir(ds) if players is None else players
+        return self._matrix(players, [file_hash(ds + "/" + player) for player in players], model_classes)
+
+    def _matrix(self, players: List[str], hashes: List[str], model_classes: Sequence[Type[KitPredictor]]) \
+            -> NDArray[Shape["*,*"], Float]:
+        keys = [model_key(cls) for cls in model_classes]
+        result = np.full(shape=(len(players), len(keys)), fill_value=np.nan)
+        for idx, (player, digest) in enumerate(zip(players, hashes)):
+            for col, key in enumerate(keys):
+                result[idx, col] = self.results.get((player, digest, key), np.nan)
+        return result
@@ -1,14 +1,12 @@
 # Compute the differences between kit and preference for a whole dataset
 import os
-from collections import defaultdict
 from typing import Iterable, Dict, Tuple
 
 import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib.axes import Axes
 
+from instrumentation import timed
 from items import Inventory
-from utils import read_file
+from utils import read_codes, dataset_diffs, kit_diffs, first_appearance_ids
 
 
 def compute_diff(_kit: Iterable, _sort: Iterable) -> (float, float):
@@ -17,11 +15,11 @@ def compute_diff(_kit: Iterable, _sort: Iterable) -> (float, float):
 
     _bar_diff = 0
     for i, ki, si in zip(range(0, 36), _kit, _sort):
-        if ki is None:
+        if not ki:  # None or 0, empty slot
             continue
 
         _item_count = _item_count + 1
-        if si is None or ki != si:
+        if not si or ki != si:
             _diff_count = _diff_count + 1
 
         if i == 8:
@@ -31,26 +29,12 @@ def compute_diff(_kit: Iterable, _sort: Iterable) -> (float, float):
 
 
 def check_differences(ds: str = "kit_data/min_10"):
-    pl_files = os.listdir(ds)
-    results = np.zeros(shape=(len(pl_files), 4))
-
-    for idx, user in enumerate(pl_files):
-        df = read_file(ds + "/" + user, convert_items=True)
-
-        for _idx, _row in df.iterrows():
-            kit = _row["kit_0":"kit_35"]
-            sort = _row["sorted_0":"sorted_35"]
-
-            kit_diff, bar_diff = compute_diff(kit, sort)
-            results[idx, 0:2] += kit_diff, bar_diff
-            results[idx, 2:4] += kit_diff > 0, bar_diff > 0
-
-        results[idx, :] = results[idx, :] / df.shape[0]
-
-    return results
+    return dataset_diffs(ds)
 
 
 def scatter_hist(x, y, lab_x=None, lab_y=None, bins_x=None, bins_y=None):
+    from matplotlib import pyplot as plt
+
     # start with a square Figure
     fig = plt.figure(figsize=(8, 8))
 
@@ -61,7 +45,7 @@ def scatter_hist(x, y, lab_x=None, lab_y=None, bins_x=None, bins_y=None):
                           left=0.1, right=0.9, bottom=0.1, top=0.9,
                           wspace=0.05, hspace=0.05)
 
-    ax: Axes = fig.add_subplot(gs[1, 0])
+    ax = fig.add_subplot(gs[1, 0])
     plt.xlabel(lab_x)
     plt.ylabel(lab_y)
     ax_histx = fig.add_subplot(gs[0, 0], sharex=ax)
@@ -86,6 +70,8 @@ def scatter_hist(x, y, lab_x=None, lab_y=None, bins_x=None, bins_y=None):
 
 
 def show_scatter_hists(ds, whole=False, bar=True):
+    from matplotlib import pyplot as plt
+
     edition_diffs = check_differences(ds)
     kit_edited_amount, kit_edited_times = edition_diffs[:, 0], edition_diffs[:, 2]
     bar_edited_amount, bar_edited_times = edition_diffs[:, 1], edition_diffs[:, 3]
@@ -105,50 +91,65 @@ def show_scatter_hists(ds, whole=False, bar=True):
         plt.show()
 
 
-def compute_kit_modifications(ds) -> Dict[Inventory, Tuple[float, float, float, float, float]]:
+@timed()
+def compute_kit_modifications(ds, progress: bool = False) -> Dict[Inventory, Tuple[int, int, float, float, float]]:
+    """
+    How much each kit in a dataset gets edited, aggregated first per player and then overall
+    :param ds: dataset directory, with a parquet file per player
+    :param progress: True to print progress every 50 files
+    :return: stats for each kit, by order of first appearance
+    """
     pl_files = os.listdir(ds)
 
-    # total_cnt: total count, overall amount of times the kit was given
-    # total_pl_cnt: total player count who received this kit
-    # total_sum: total sum of edition % (for each time kit is given, 0 to 1)
-    # total_pl_sum: total sum of edition %, per player (each player 0 to 1)
-    # total_ed_cnt: total edition count, amount of times kit was edited (0 or 1 each time kit is given)
-    results: Dict[Inventory, Tuple[float, float, float, float, float]] = defaultdict(lambda: (0, 0, 0, 0, 0))
-
+    # Reduce the dataset to one (player, kit, bar_diff) entry per row
+    players, kits, bar_diffs = [], [], []
     for idx, user in enumerate(pl_files):
-        df = read_file(ds + "/" + user, convert_items=True, only_category=True)
-
-        user_results: Dict[Inventory, Tuple[float, float, float]] = defaultdict(lambda: (0, 0, 0))
-
-        for _idx, _row in df.iterrows():
-            kit = Inventory.of(_row, "kit")
-            sort = Inventory.of(_row, "sorted")
+        kit_codes, sort_codes = read_codes(ds + "/" + user)
+        players.append(np.full(shape=len(kit_codes), fill_value=idx))
+        kits.append(kit_codes)
+        bar_diffs.append(kit_diffs(kit_codes, sort_codes)[1])
 
-            kit_diff, bar_diff = compute_diff(kit, sort)
-            pl_count, pl_sum, pl_edition_c = user_results[kit]
-            user_results[kit] = (pl_count + 1, pl_sum + bar_diff, pl_edition_c + (1 if bar_diff > 0 else 0))
-
-        for kit, val in user_results.items():
-            total_cnt, total_pl_cnt, total_sum, total_pl_sum, total_ed_cnt = results[kit]
-            pl_count, pl_sum, pl_edition_c = user_results[kit]
-            results[kit] = (total_cnt + pl_count,
-                            total_pl_cnt + 1,
-                            total_sum + pl_sum,
-                            total_pl_sum + (pl_sum / pl_count),
-                            total_ed_cnt + pl_edition_c)
-
-        if idx % 50 == 0:
+        if progress and idx % 50 == 0:
             print("%d/%d" % (idx, len(pl_files)))
 
+    if not pl_files:
+        return {}
+    players, kits, bar_diffs = np.concatenate(players), np.concatenate(kits), np.concatenate(bar_diffs)
+    kit_ids, kit_rows = first_appearance_ids(kits)
+    edited = bar_diffs > 0
+
+    # Per player & kit: rows are grouped by player, so groups are numbered by player first, then by kit
+    groups, group_rows = first_appearance_ids(players * len(kit_rows) + kit_ids)
+    pl_count = np.bincount(groups)
+    pl_sum = np.bincount(groups, weights=bar_diffs)
+    group_kits = kit_ids[group_rows]
+
+    # total count: overall amount of times the kit was given
+    # player count: amount of players who received this kit
+    # total sum of edition % (for each time kit is given, 0 to 1)
+    # total sum of edition %, per player (each player 0 to 1)
+    # edition count: amount of times kit was edited (0 or 1 each time kit is given)
+    total_cnt = np.bincount(kit_ids)
+    total_pl_cnt = np.bincount(group_kits)
+    total_sum = np.bincount(group_kits, weights=pl_sum)
+    total_pl_sum = np.bincount(group_kits, weights=pl_sum / pl_count)
+    total_ed_cnt = np.bincount(kit_ids[edited], minlength=len(kit_rows))
+
     # total count
     # player count
     # edition % overall average (average amount edited overall)
     # edition % per-player average (average amount edited aggregated first by player, then overall)
     # edition count % (times the kit was edited in any amount)
-    return {k: (v[0], v[1], v[2] / v[0], v[3] / v[1], v[4] / v[0]) for (k, v) in results.items()}
+    return {Inventory.of_codes(kits[row].copy()): (int(total_cnt[k]), int(total_pl_cnt[k]),
+                                                   float(total_sum[k] / total_cnt[k]),
+                                                   float(total_pl_sum[k] / total_pl_cnt[k]),
+                                                   float(total_ed_cnt[k] / total_cnt[k]))
+            for k, row in enumerate(kit_rows)}
 
 
 def show_kit_scatter_hists(ds: str, x, y):
+    from matplotlib import pyplot as plt
+
     if x is None or y is None:
         computed_kit_data = compute_kit_modifications(ds)
 
@@ -0,0 +1,142 @@
+# Persistent per-player model snapshots, so models only need to learn from rows they haven't seen yet
+import hashlib
+import itertools
+import json
+import os
+from typing import Optional, Tuple, Type, Dict
+
+import numpy as np
+
+from items import Categories
+from models import KitPredictor, NaiveBayesPredictor3
+from utils import iter_blocks
+from utils.dataset import player_name
+
+
+def row_digest(kit: np.ndarray, pref: np.ndarray) -> str:
+    """
+    Digest of the category codes of a single row, snapshots keep the one of the last row learned
+    """
+    return hashlib.sha1(np.concatenate([kit, pref]).astype(Categories.CODE_DTYPE).tobytes()).hexdigest()
+
+
+class SnapshotStore:
+    """
+    Directory with the trained state of a model for each player. Each player has a <player>.npy file with the model
+    state (see NaiveBayesPredictor3.get_state), and a <player>.json file with the watermark: the amount of rows
+    learned, and what they were learned from: the size & mtime of the data file and a digest of the last row learned,
+    to detect when the data file has been rewritten.
+    """
+
+    def __init__(self, directory: str, model_cls: Type[KitPredictor] = NaiveBayesPredictor3):
+        self.directory = directory
+        self.model_cls = model_cls
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, player: str) -> str:
+        return self.directory + "/" + player
+
+    def _meta(self) -> Dict[str, object]:
+        return {"model": self.model_cls.__name__, "version": self.model_cls.MODEL_VERSION,
+                "categories": Categories.fingerprint()}
+
+    def _load_meta(self, player: str) -> Optional[Dict[str, object]]:
+        try:
+            with open(self._path(player) + ".json", "r") as f:
+                meta = json.load(f)
+            if any(meta.get(k) != v for k, v in self._meta().items()) or "rows" not in meta:
+                return None
+            return meta
+        except (OSError, ValueError):
+            return None
+
+    def load(self, player: str, mmap: bool = True) -> Tuple[Optional[np.ndarray], int]:
+        """
+        Load the stored state for a player
+        :param player: player name
+        :param mmap: True to memory-map the state (read only) instead of reading it, models use it without copying
+        until they learn (see NaiveBayesPredictor3.set_state)
+        :return: the model state and the watermark, (None, 0) if there's no valid snapshot
+        """
+        meta = self._load_meta(player)
+        if meta is None:
+            return None, 0
+        try:
+            return np.load(self._path(player) + ".npy", mmap_mode="r" if mmap else None), meta["rows"]
+        except (OSError, ValueError):
+            return None, 0
+
+    def load_model(self, player: str) -> Tuple[KitPredictor, int]:
+        """
+        Get a model for the player from its snapshot, or an untrained one if there's none
+        :return: the model and the amount of rows it has learned
+        """
+        model = self.model_cls()
+        state, rows = self.load(player)
+        if state is not None:
+            model.set_state(state)
+        return model, rows
+
+    def save(self, player: str, model: KitPredictor, rows: int, source: Optional[Dict[str, object]] = None) -> None:
+        """
+        Store the state of a model for a player, after having learned the first rows of its data
+        :param source: what the rows were learned from, see update. Without it the next update relearns everything
+        """
+        path = self._path(player)
+        # Write the state first, so a crash can never leave a watermark pointing to an older state
+        with open(path + ".npy.tmp", "wb") as f:
+            np.save(f, model.get_state())
+        os.replace(path + ".npy.tmp", path + ".npy")
+        with open(path + ".json.tmp", "w") as f:
+            json.dump(dict(self._meta(), rows=rows, source=source), f)
+        os.replace(path + ".json.tmp", path + ".json")
+
+    def update(self, file: str, player: str = None) -> KitPredictor:
+        """
+        Bring the snapshot of a player up to date with its data file, only reading & learning the rows after the
+        watermark. Nothing is read if the file has the same size & mtime as last time. Otherwise, the last row learned
+        is checked to still be in place, if it isn't (eg: the file was rewritten by prune_dataset) the model is trained
+        again from scratch.
+        :param file: player data file, or consolidated dataset if player is set
+        :param player: player name, defaults to the file name
+        :return: the up-to-date model
+        """
+        name = player if player is not None else player_name(file)
+        # Taken before reading, so a file rewritten while it's being learned is checked again next time
+        stat = os.stat(file)
+        meta = self._load_meta(name)
+        source = meta.get("source") if meta is not None else None
+        model, rows = self.load_model(name)
+        if source is not None and source.get("size") == stat.st_size and source.get("mtime_ns") == stat.st_mtime_ns \
+                and rows == meta["rows"]:
+            return model
+
+        blocks = iter_blocks(file, player=player, start=max(rows - 1, 0))
+        last = None
+        if rows > 0:
+            first = next(blocks, None)
+            if first is None or source is None or row_digest(first[0][0], first[1][0]) != source.get("last"):
+                model, rows = self.model_cls(), 0
+                blocks = iter_blocks(file, player=player)
+            else:
+                last = first[0][0], first[1][0]
+                blocks = itertools.chain([(first[0][1:], first[1][1:])], blocks)
+
+        learned = 0
+        for kits, prefs in blocks:
+            if len(kits) == 0:
+                continue
+            model.learn_batch(kits, prefs)
+            learned += len(kits)
+            last = kits[-1], prefs[-1]
+
+        self.save(name, model, rows + learned, {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                                "last": row_digest(*last) if last is not None else None})
+        return model
+
+    def update_dataset(self, ds: str) -> None:
+        """
+        Bring the snapshots for every player in a dataset directory up to date
+        """
+        for user in os.listdir(ds):
+            self.update(ds + "/" + user)
@@ -0,0 +1,100 @@
+# Synthetic kit datasets with the same schema as the real one, for testing & benchmarking
+import os
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from items import Material, Categories, Bucket
+from items.categories import EnchantmentCategory
+from .utils import KIT_COLUMNS, SORTED_COLUMNS
+
+# Items kits are made from: always a weapon, then a mix of the rest
+_WEAPONS = [Material.WOOD_SWORD, Material.STONE_SWORD, Material.IRON_SWORD, Material.DIAMOND_SWORD, Material.BOW]
+_EXTRAS = [Material.IRON_PICKAXE, Material.DIAMOND_PICKAXE, Material.IRON_AXE, Material.STONE_AXE, Material.IRON_SPADE,
+           Material.SHEARS, Material.GOLDEN_APPLE, Material.POTION, Material.COOKED_BEEF, Material.BREAD,
+           Material.WOOD, Material.GLASS, Material.WOOL, Material.LOG, Material.SANDSTONE, Material.ARROW,
+           Material.WATER_BUCKET, Material.LAVA_BUCKET, Material.BUCKET, Material.TNT, Material.FLINT_AND_STEEL]
+
+
+def serialize(material: Material, amount: int = 1, data: int = 0) -> int:
+    """
+    Serialize an item stack the same way ItemStack reads it: material id, amount and data (or enchant bits)
+    """
+    return (material.value << 16) | ((amount & 0xff) << 8) | (data & 0xff)
+
+
+def random_item(rng: np.random.Generator, material: Material) -> int:
+    category = Categories.of(material)
+    if isinstance(category, EnchantmentCategory):
+        data = int(rng.integers(0, 1 << len(category.enchants)))
+        return serialize(material, 1, data)
+    if isinstance(category, Bucket):
+        return serialize(material)
+    if material == Material.POTION:
+        return serialize(material, 1, int(rng.integers(0, 4)))
+    return serialize(material, int(rng.integers(1, 65)), 0)
+
+
+def random_kit(rng: np.random.Generator, min_items: int = 4, max_items: int = 14) -> np.ndarray:
+    """
+    A random kit: a weapon in the first slot, and a random amount of other items spread over the inventory
+    """
+    kit = np.zeros(shape=36, dtype=np.int64)
+    kit[0] = random_item(rng, _WEAPONS[rng.integers(len(_WEAPONS))])
+    amount = int(rng.integers(min_items, max_items + 1)) - 1
+    # Favour the hotbar, like real kits do
+    weights = np.where(np.arange(1, 36) < 9, 4.0, 1.0)
+    slots = rng.choice(np.arange(1, 36), size=amount, replace=False, p=weights / np.sum(weights))
+    for slot in slots:
+        kit[slot] = random_item(rng, _EXTRAS[rng.integers(len(_EXTRAS))])
+    return kit
+
+
+def player_layout(rng: np.random.Generator, swaps: int = 3) -> np.ndarray:
+    """
+    Preferred layout of a player, as a permutation of the inventory slots: a few hotbar slots swapped with other slots
+    """
+    layout = np.arange(36)
+    for _ in range(swaps):
+        a, b = rng.integers(0, 9), rng.integers(0, 36)
+        layout[a], layout[b] = layout[b], layout[a]
+    return layout
+
+
+def generate_dataset(dest: str, players: int = 100, rows: int = 200, kit_types: int = 50, skew: float = 1.2,
+                     edit_rate: float = 0.3, seed: int = 0) -> List[str]:
+    """
+    Write a synthetic dataset, one parquet file per player with the kit_0..35 & sorted_0..35 schema
+    :param dest: directory to write to
+    :param players: amount of players
+    :param rows: average amount of rows per player (row counts follow a geometric distribution, like the real data)
+    :param kit_types: amount of distinct kits given out
+    :param skew: zipf exponent for how often each kit type is given, higher means a few kits are much more common
+    :param edit_rate: probability for a player to sort a kit they're given
+    :param seed: random seed
+    :return: list of files written
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(dest, exist_ok=True)
+
+    kits = np.array([random_kit(rng) for _ in range(kit_types)])
+    popularity = 1 / np.arange(1, kit_types + 1) ** skew
+    popularity /= np.sum(popularity)
+
+    files = []
+    for _ in range(players):
+        player = "%08x-%04x-%04x-%04x-%012x" % tuple(int(rng.integers(0, 1 << b)) for b in (32, 16, 16, 16, 48))
+        n = int(rng.geometric(1 / rows))
+        given = kits[rng.choice(kit_types, size=n, p=popularity)]
+
+        layout = player_layout(rng)
+        sorted_kits = given.copy()
+        edited = rng.random(size=n) < edit_rate
+        sorted_kits[edited] = given[edited][:, layout]
+
+        df = pd.DataFrame(np.concatenate([given, sorted_kits], axis=1), columns=KIT_COLUMNS + SORTED_COLUMNS)
+        file = dest + "/" + player + ".parquet"
+        df.to_parquet(file)
+        files.append(file)
+    return files
@@ -1,50 +1,194 @@
 import os
 import shutil
-import threading
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Counter, Callable, TypeVar, Hashable
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Counter, Callable, TypeVar, Hashable, Tuple, Iterator
 
 import numpy as np
 import pandas
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pds
 import pyarrow.parquet as pq
 from pandas import Series
 
+from instrumentation import timed, timer, count, task, task_result
 from items import *
+from .dataset import read_player, read_dataset, dataset_filter
+from .decoded_cache import decoded_cache
+from .kit_registry import kit_types, KitTypeRegistry
+from .manifest import build_manifest, row_count
 
+KIT_COLUMNS = ["kit_" + str(i) for i in range(0, 36)]
+SORTED_COLUMNS = ["sorted_" + str(i) for i in range(0, 36)]
 
-def read_file(file: str, convert_items: bool = True, only_category: bool = False) -> pandas.DataFrame:
+
+@timed()
+def read_file(file: str, convert_items: bool = True, only_category: bool = False, player: str = None) \
+        -> pandas.DataFrame:
     """
     Read a parquet file with kit data into a dataframe
     :param file: path for the file to read
     :param convert_items: if item cells should be converted from ints to item stacks or categories
     :param only_category: True to convert to categories, false to convert to item stacks
+    :param player: if set, file is a consolidated dataset and only this player's rows are read
     :return: a pandas dataframe with the data
     """
-    result = pd.read_parquet(file, engine="pyarrow")
+    result = pd.read_parquet(file, engine="pyarrow") if player is None else read_player(file, player)
+    count("rows_read", len(result))
     if convert_items:
-        for i in range(0, 36):
-            result["kit_" + str(i)] = result["kit_" + str(i)] \
-                .apply(Categories.ofSerialized if only_category else ItemStack.of)
-            result["sorted_" + str(i)] = result["sorted_" + str(i)] \
-                .apply(Categories.ofSerialized if only_category else ItemStack.of)
+        if only_category:
+            columns = KIT_COLUMNS + SORTED_COLUMNS
+            if player is None and decoded_cache() is not None:
+                codes = np.column_stack(read_codes(file))
+            else:
+                codes = Categories.codesOfSerialized(result[columns].to_numpy(dtype=np.int64))
+            categories = Categories.ofCodes(codes)
+            for i, col in enumerate(columns):
+                result[col] = categories[:, i]
+        else:
+            with timer("decode_item_stacks"):
+                columns = KIT_COLUMNS + SORTED_COLUMNS
+                stacks = ItemStack.ofTable(ItemStack.tableOfSerialized(result[columns].to_numpy(dtype=np.int64)))
+                for i, col in enumerate(columns):
+                    result[col] = stacks[:, i]
     return result
 
 
-def row_count(file: str) -> int:
+def serialized_items(table) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the item columns of a kit table (pyarrow table, record batch or dataframe) as raw serialized item stacks
+    :param table: table containing the kit_0..35 and sorted_0..35 columns
+    :return: two (rows x 36) int64 matrices with the serialized items for the kit and the sorted kit
+    """
+    serialized = np.column_stack([np.asarray(table[col], dtype=np.int64) for col in KIT_COLUMNS + SORTED_COLUMNS])
+    return serialized[:, 0:36], serialized[:, 36:72]
+
+
+@timed()
+def decode_codes(table) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Read the row count in a parquet file
+    Decode the item columns of a kit table (pyarrow table, record batch or dataframe) into category codes
+    :param table: table containing the kit_0..35 and sorted_0..35 columns
+    :return: two (rows x 36) matrices with the category codes for the kit and the sorted kit
     """
-    return pq.read_table(file, columns=[]).num_rows
+    codes = Categories.codesOfSerialized(np.column_stack(serialized_items(table)))
+    count("rows_decoded", len(codes))
+    return codes[:, 0:36], codes[:, 36:72]
 
 
-def split_datasets(sizes: List[int] = None, source: str = "kit_data/all", dest: str = "kit_data/min_", dry_run: bool = None) -> List[int]:
+@timed()
+def read_codes(file: str, player: str = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read a parquet file with kit data as dense category code matrices, without creating any python objects per item.
+    Use Categories.ofCodes or Inventory to get category objects back. When the decoded cache is enabled (see
+    enable_decoded_cache) whole files are read from it, as read only memory-mapped arrays.
+    :param file: path for the file to read
+    :param player: if set, file is a consolidated dataset and only this player's rows are read
+    :return: two (rows x 36) matrices with the category codes for the kit and the sorted kit
+    """
+    if player is not None:
+        return decode_codes(read_dataset(file, players=[player], columns=KIT_COLUMNS + SORTED_COLUMNS))
+    cache = decoded_cache()
+    if cache is None:
+        return decode_codes(pq.read_table(file, columns=KIT_COLUMNS + SORTED_COLUMNS))
+
+    codes = cache.load(file)
+    if codes is None:
+        meta = cache.source_meta(file)
+        decoded = decode_codes(pq.read_table(file, columns=KIT_COLUMNS + SORTED_COLUMNS))
+        codes = cache.store(file, np.column_stack(decoded), meta)
+    return codes[:, 0:36], codes[:, 36:72]
+
+
+@timed()
+def read_item_table(file: str, player: str = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read a parquet file with kit data as item tables, decoding every item stack without creating any python objects.
+    Use ItemStack.ofTable to get item stacks back, for the rows that are needed.
+    :param file: path for the file to read
+    :param player: if set, file is a consolidated dataset and only this player's rows are read
+    :return: two (rows x 36) item tables (see ItemStack.tableOfSerialized) for the kit and the sorted kit
+    """
+    table = read_dataset(file, players=[player], columns=KIT_COLUMNS + SORTED_COLUMNS) if player is not None \
+        else pq.read_table(file, columns=KIT_COLUMNS + SORTED_COLUMNS)
+    items = ItemStack.tableOfSerialized(np.column_stack(serialized_items(table)))
+    return items[:, 0:36], items[:, 36:72]
+
+
+def read_batches(file: str, columns: List[str], batch_size: int = 4096, player: str = None, start: int = 0) \
+        -> Iterator[pa.RecordBatch]:
+    """
+    Stream a parquet file (or a single player from a consolidated dataset) in record batches
+    :param start: amount of rows to skip, row groups that are fully skipped aren't read
+    """
+    if player is not None:
+        batches = pds.dataset(file, format="parquet").to_batches(columns=columns, batch_size=batch_size,
+                                                                  filter=dataset_filter(players=[player]))
+    else:
+        pf = pq.ParquetFile(file)
+        row_groups = []
+        for group in range(pf.num_row_groups):
+            rows = pf.metadata.row_group(group).num_rows
+            if start >= rows and not row_groups:
+                start -= rows
+            else:
+                row_groups.append(group)
+        batches = pf.iter_batches(batch_size=batch_size, columns=columns, row_groups=row_groups)
+
+    for batch in batches:
+        if start >= batch.num_rows:
+            start -= batch.num_rows
+            continue
+        yield batch.slice(start) if start > 0 else batch
+        start = 0
+
+
+def iter_blocks(file: str, batch_size: int = 4096, player: str = None, decode: bool = True, start: int = 0) \
+        -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Stream a parquet file with kit data in blocks of rows, in constant memory
+    :param file: path for the file to read
+    :param batch_size: max amount of rows per block
+    :param player: if set, file is a consolidated dataset and only this player's rows are read
+    :param decode: True to get category codes, False to get the raw serialized item stacks
+    :param start: amount of rows to skip
+    :return: iterator of (kits, sorted) pairs of (rows x 36) matrices
+    """
+    for batch in read_batches(file, KIT_COLUMNS + SORTED_COLUMNS, batch_size, player, start):
+        if batch.num_rows == 0:
+            continue
+        yield decode_codes(batch) if decode else serialized_items(batch)
+
+
+def iter_rows(file: str, batch_size: int = 4096, player: str = None, decode: bool = True, start: int = 0) \
+        -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Stream a parquet file with kit data row by row, in constant memory. Replacement for DataFrame.iterrows
+    :return: iterator of (kit, sorted) pairs of 36 item arrays, see iter_blocks
+    """
+    for kits, prefs in iter_blocks(file, batch_size, player, decode, start):
+        yield from zip(kits, prefs)
+
+
+def item_keys(serialized: np.ndarray) -> np.ndarray:
+    """
+    Comparison keys for serialized item stacks with the same semantics as ItemStack: 0 for empty slots, and all invalid
+    item stacks (unknown material) compare equal to each other.
+    """
+    invalid = (serialized != 0) & (Categories.material_codes()[(serialized >> 16) & 0xffff] == 0)
+    return np.where(invalid, -1, serialized)
+
+
+@timed()
+def split_datasets(sizes: List[int] = None, source: str = "kit_data/all", dest: str = "kit_data/min_",
+                   dry_run: bool = None, link: str = "hardlink") -> List[int]:
     """
     Split dataset into folders for players with at least n kit preferences saved
     :param sizes: list of sizes
     :param source: source dataset
     :param dest: dataset prefix to use
     :param dry_run: True to ignore copying files, useful to just get a count of kit sizes
+    :param link: how to materialize files in the split folders: "hardlink", "symlink" or "copy"
     :return: a list with the sizes for all the kits
     """
     if sizes is None:
@@ -52,75 +196,176 @@ def split_datasets(sizes: List[int] = None, source: str = "kit_data/all", dest:
     if dry_run is None:
         dry_run = all([os.path.isdir(dest + str(s) + "/") for s in sizes])
 
-    result = []
+    manifest = build_manifest(source)
+    result = [entry.rows for entry in manifest.values()]
 
     if not dry_run:
         for s in sizes:
-            path = dest + str(s) + "/"
-            if os.path.isdir(path):
-                shutil.rmtree(path)
-            os.mkdir(path)
-
-    for user in os.listdir(source):
-        rows = row_count(source + "/" + user)
-        result.append(rows)
-        if dry_run:
-            continue
-        for s in sizes:
-            if rows >= s:
-                shutil.copy(source + "/" + user, dest + str(s) + "/" + user)
+            sync_split(source, dest + str(s) + "/", [user for user, entry in manifest.items() if entry.rows >= s], link)
 
     return result
 
 
-def as_kit_type(_row: Series) -> Inventory:
-    return Inventory(sorted(filter(None, _row["kit_0":"kit_35"].apply(Categories.ofSerialized).unique())))
+def sync_split(source: str, path: str, users: List[str], link: str = "hardlink") -> None:
+    """
+    Make the folder in path contain exactly the given files from source, only touching what changed
+    """
+    os.makedirs(path, exist_ok=True)
+    wanted = set(users)
+    for existing in os.listdir(path):
+        if existing not in wanted:
+            os.remove(path + existing)
+
+    for user in users:
+        src, dst = source + "/" + user, path + user
+        if os.path.lexists(dst):
+            if _same_file(src, dst):
+                continue
+            os.remove(dst)
+        _materialize(src, dst, link)
+
+
+def _same_file(src: str, dst: str) -> bool:
+    try:
+        if os.path.samefile(src, dst):
+            return True
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+        return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+    except OSError:
+        return False
+
+
+def _materialize(src: str, dst: str, link: str) -> None:
+    if link == "symlink":
+        os.symlink(os.path.relpath(src, os.path.dirname(dst)), dst)
+        return
+    if link == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:  # Eg: different file systems, fall back to copying
+            pass
+    shutil.copy2(src, dst)
 
 
 T = TypeVar("T")
 
 
-# Count-up all separate "kit types" in the dataset
-def count_kits(ds: str = "kit_data/min_10", to_kit: Callable[[Series], T] = as_kit_type) -> Counter[T]:
-    lock = threading.Lock()
-    result = Counter[T]()
+def kit_type(kit: np.ndarray) -> Inventory:
+    """
+    Kit type for a single kit of category codes, the distinct categories it contains, sorted
+    """
+    types = kit_types(np.asarray(kit)[None, :])[0]
+    return Inventory.of_codes(types[types != 0])
 
-    def handle_player(file):
-        df = read_file(file, convert_items=False)
-        for _idx, _row in df.iterrows():
-            inv = to_kit(_row)
-            lock.acquire()
-            result[inv] += 1
-            lock.release()
 
-    files = os.listdir(ds)
-    with ThreadPoolExecutor(max_workers=32) as executor:
-        lock = threading.Lock()
-        for player_file in files:
-            executor.submit(handle_player, ds + "/" + player_file)
+def as_kit_type(_row: Series) -> Inventory:
+    return kit_type(Categories.codesOfSerialized(_row[KIT_COLUMNS].to_numpy(dtype=np.int64)))
+
+
+def file_kit_types(file: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Distinct kit types in a single file, and the amount of times each was given
+    :return: (types x 36) matrix of kit types (see kit_types) and the count for each of them
+    """
+    kits, _ = read_codes(file)
+    return np.unique(kit_types(kits), axis=0, return_counts=True)
+
 
+def count_kit_ids(ds: str, registry: KitTypeRegistry, use_processes: bool = True, max_workers: int = None) \
+        -> np.ndarray:
+    """
+    Count the amount of times each kit type has been given over a whole dataset, by kit type id
+    :param ds: dataset directory
+    :param registry: registry for the kit type ids, new kit types are added to it
+    :param use_processes: True to use worker processes, False for threads
+    :param max_workers: amount of workers, default from the executor
+    :return: array with the count for each kit type id in the registry
+    """
+    files = [ds + "/" + player_file for player_file in os.listdir(ds)]
+    counts = np.zeros(shape=len(registry), dtype=np.int64)
+    with (ProcessPoolExecutor if use_processes else ThreadPoolExecutor)(max_workers=max_workers) as executor:
+        worker = task(file_kit_types) if use_processes else file_kit_types
+        for result in executor.map(worker, files, chunksize=16 if use_processes else 1):
+            types, file_counts = task_result(result)
+            ids = registry.intern(types)
+            if len(registry) > len(counts):
+                counts = np.concatenate([counts, np.zeros(shape=len(registry) - len(counts), dtype=np.int64)])
+            # Kit types are unique within a file, so there's no repeated ids
+            counts[ids] += file_counts
+    return counts
+
+
+def count_file_kits_with(file: str, to_kit: Callable[[Series], T]) -> Counter[T]:
+    """
+    Count the kit types in a single file, using a custom row to kit type conversion
+    """
+    result = Counter[T]()
+    df = read_file(file, convert_items=False)
+    for _idx, _row in df.iterrows():
+        result[to_kit(_row)] += 1
     return result
 
 
+# Count-up all separate "kit types" in the dataset
+@timed()
+def count_kits(ds: str = "kit_data/min_10", to_kit: Callable[[Series], T] = None, use_processes: bool = None,
+               max_workers: int = None, registry: KitTypeRegistry = None) -> Counter[T]:
+    """
+    Count the amount of times each kit type has been given over a whole dataset
+    :param ds: dataset directory
+    :param to_kit: custom conversion from a row to a kit type, defaults to kit types computed for the whole file at once
+    :param use_processes: True to use worker processes, False for threads. Defaults to processes unless to_kit is
+                          set, to_kit needs to be picklable for processes to be used
+    :param max_workers: amount of workers, default from the executor
+    :param registry: kit type registry to count with (see count_kit_ids), defaults to a new one
+    :return: counter of kit types
+    """
+    if use_processes is None:
+        use_processes = to_kit is None
+    if to_kit is None:
+        registry = KitTypeRegistry() if registry is None else registry
+        counts = count_kit_ids(ds, registry, use_processes, max_workers)
+        return Counter({registry.kit(kit_id): int(counts[kit_id]) for kit_id in np.flatnonzero(counts)})
+
+    files = [ds + "/" + player_file for player_file in os.listdir(ds)]
+    result = Counter()
+    with (ProcessPoolExecutor if use_processes else ThreadPoolExecutor)(max_workers=max_workers) as executor:
+        worker = task(count_file_kits_with) if use_processes else count_file_kits_with
+        for partial in executor.map(worker, files, [to_kit] * len(files)):
+            result.update(task_result(partial))
+        return result
+
+
 def print_kit_counter(kit_counter: Counter[object]):
     for kit, count in sorted(kit_counter.items(), key=lambda kv: kv[1], reverse=False):
         print(str(count) + "\t" + str(kit))
 
 
 # Display visually original kit and preference kit in a table
-def display_changes(pl_file, ds: str = "kit_data/all"):
-    df = read_file(ds + "/" + pl_file, only_category=True)
-    arr = np.empty(shape=(df.shape[0] * 2, 37), dtype=object)
-
-    kit_start = df.columns.get_loc("kit_0")
-    kit_end = df.columns.get_loc("kit_35")+1
-    sort_start = df.columns.get_loc("sorted_0")
-    sort_end = df.columns.get_loc("sorted_35")+1
+def display_changes(pl_file, ds: str = "kit_data/all", item_stacks: bool = False):
+    """
+    Kits of a player next to how they sorted them, one row for the kit and one for the sorted kit
+    :param item_stacks: True to show the item stacks, instead of only their category
+    """
+    file = ds + "/" + pl_file
+    # First column of the file is used as a label for each kit
+    label = pq.ParquetFile(file).schema_arrow.names[0]
+    rows = row_count(file)
+    arr = np.empty(shape=(rows * 2, 37), dtype=object)
 
-    _idx: int
-    for _idx, _row in df.iterrows():
-        arr[(_idx * 2), 1:] = _row[kit_start:kit_end]
-        arr[(_idx * 2) + 1, 1:] = _row[sort_start:sort_end]
-        arr[(_idx * 2), 0] = _row[0]
+    _idx = 0
+    for batch in read_batches(file, list(dict.fromkeys([label] + KIT_COLUMNS + SORTED_COLUMNS))):
+        end = _idx + batch.num_rows
+        if item_stacks:
+            table = ItemStack.tableOfSerialized(np.column_stack(serialized_items(batch)))
+            kits, prefs = ItemStack.ofTable(table[:, 0:36]), ItemStack.ofTable(table[:, 36:72])
+        else:
+            kits, prefs = (Categories.ofCodes(codes) for codes in decode_codes(batch))
+        arr[(_idx * 2):(end * 2):2, 1:] = kits
+        arr[(_idx * 2) + 1:(end * 2):2, 1:] = prefs
+        arr[(_idx * 2):(end * 2):2, 0] = kits[:, 0] if label == "kit_0" else \
+            batch[label].to_numpy(zero_copy_only=False)
+        _idx = end
 
     return arr